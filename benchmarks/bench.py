@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of ECOW's own overhead, using the stand-in commands in fake/.
+
+Each measurement runs in a fresh copy of the package (so that the configuration,
+result stores and status database of the checkout are not touched) and in its own
+Python process, which calls Main().Run() once and reports:
+
+- throughput (solutions per second)
+- time spent in each phase: dedup (FileProcess.CheckSolution), store
+  (FileProcess.SolutionRestore), status (StatusManager), submit and poll
+  (SendProcess / GetProcess of the backend, excluding the phases above)
+- peak memory (maximum resident set size of the process)
+
+Usage
+-----
+    python3 benchmarks/bench.py                          # default batch and history sizes
+    python3 benchmarks/bench.py --batches 1,100 --histories 0,100000 --backend qsub
+    python3 benchmarks/bench.py --result-delay 0.5 --failure-rate 0.01 --json out.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+# Directory of this file and of the repository
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPO_DIRECTORY = os.path.dirname(BENCH_DIRECTORY)
+# Directory of the stand-in opt and qsub commands
+FAKE_DIRECTORY = os.path.join(BENCH_DIRECTORY, 'fake')
+
+# Default sizes: batch sizes are measured with an empty result store,
+# history sizes with a batch of DEFAULT_HISTORY_BATCH solutions
+DEFAULT_BATCHES = [1, 10, 100, 1000, 10000]
+DEFAULT_HISTORIES = [1000, 10000, 100000]
+DEFAULT_HISTORY_BATCH = 100
+# Number of dimensions of the generated solutions
+DIMENSIONS = 10
+# Phases reported for each run
+PHASES = ["dedup", "submit", "poll", "store", "status"]
+
+
+def Prepare(workdir, backend, array):
+    """Copy the package into workdir/ECOW and configure it for the stand-in commands.
+
+    Parameters
+    ----------
+    workdir (string):
+        Empty working directory
+    backend (string):
+        "opt", "qsub" or "local"
+    array (boolean):
+        Whether qsub submits job arrays
+    """
+    package = os.path.join(workdir, 'ECOW')
+    shutil.copytree(REPO_DIRECTORY, package,
+                    ignore=shutil.ignore_patterns('.git', 'benchmarks', '__pycache__', '*.db', '__queue'))
+    config_file = os.path.join(package, 'comp_module', '__config_files', '__config.json')
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    evaluate = os.path.join(FAKE_DIRECTORY, 'evaluate')
+    config['main']['sub_to'] = backend
+    config['main']['opt']['user_name'] = 'bench'
+    config['main']['opt']['match_id'] = '1'
+    config['main']['qsub']['sub_to'] = 'bench'
+    config['main']['qsub']['bench'] = {"array": array, "script": f"#!/bin/bash\necho '${{SOLUTION}}' | {evaluate}"}
+    config['main']['local']['cmd'] = evaluate
+    # Poll often so that the measured time is dominated by ECOW rather than by waiting
+    config['polling'] = {"first": 0.05, "factor": 1.5, "max": 0.5, "jitter": 0}
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+    return package
+
+
+def Measure(args, batch, history):
+    """Run one measurement in a fresh package copy and child process and return its report.
+
+    Parameters
+    ----------
+    args (argparse.Namespace):
+        Command line arguments
+    batch (int):
+        Number of solutions sent by Run
+    history (int):
+        Number of results stored before Run
+    """
+    workdir = tempfile.mkdtemp(prefix='ecow-bench-')
+    try:
+        Prepare(workdir, args.backend, args.array)
+        env = dict(os.environ,
+                   PATH=FAKE_DIRECTORY + os.pathsep + os.environ.get('PATH', ''),
+                   PYTHONPATH=workdir,
+                   FAKE_DIR=workdir,
+                   FAKE_LATENCY=str(args.latency),
+                   FAKE_FAILURE_RATE=str(args.failure_rate),
+                   FAKE_ERROR_RATE=str(args.error_rate),
+                   FAKE_RESULT_DELAY=str(args.result_delay))
+        # Fill the result store in a separate process, so that it does not count towards the peak memory
+        for mode in (['--prefill'] if history else []) + ['--child']:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), mode, args.backend, str(batch), str(history), str(args.seed)],
+                env=env, cwd=workdir, capture_output=True, text=True, timeout=args.timeout
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(f"benchmark run failed (batch={batch}, history={history}):\n{completed.stderr}")
+        # The report is the last line; ECOW itself may print before it
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class PhaseTimer:
+    """Accumulates the time spent in wrapped functions, excluding nested wrapped calls."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.__stack = []
+
+    def Wrap(self, owner, name, phase):
+        """Replace owner.name with a wrapper that records its time under phase."""
+        function = getattr(owner, name)
+        timer = self
+
+        def wrapper(*a, **kw):
+            timer.__stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                result = function(*a, **kw)
+                if hasattr(result, '__next__'):
+                    # Generators run when they are iterated
+                    return timer.__Iterate(result, phase)
+                return result
+            finally:
+                timer.__Finish(phase, time.perf_counter() - start)
+        setattr(owner, name, wrapper)
+
+    def __Iterate(self, generator, phase):
+        while True:
+            self.__stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                self.__Finish(phase, time.perf_counter() - start)
+            yield item
+
+    def __Finish(self, phase, elapsed):
+        nested = self.__stack.pop()
+        self.seconds[phase] += elapsed - nested
+        self.calls[phase] += 1
+        if self.__stack:
+            self.__stack[-1] += elapsed
+
+
+def Prefill(backend, history, seed):
+    # Fill the result store of the recipient with evaluated solutions
+    from ECOW.comp_module.functions import fileprocess
+
+    rng = random.Random(seed + 1)
+    recipient = {"opt": "opt_1", "qsub": "qsub_bench", "local": "local"}[backend]
+    stored = [[rng.uniform(-5, 5) for _ in range(DIMENSIONS)] for _ in range(history)]
+    fileprocess.FileProcess(resultID=recipient).SolutionRestore(
+        stored, [sum(v * v for v in s) for s in stored], [{} for _ in stored])
+
+
+def Child(backend, batch, history, seed):
+    # Run Main().Run() once inside the prepared copy and print the report as JSON
+    sys.argv = ['bench']
+    from ECOW.comp_module.functions import fileprocess, optprocess, qsubprocess, localprocess, status
+    from ECOW.comp_module.functions.main import Main
+
+    rng = random.Random(seed)
+    solutions = [[rng.uniform(-5, 5) for _ in range(DIMENSIONS)] for _ in range(batch)]
+
+    timer = PhaseTimer()
+    timer.Wrap(fileprocess.FileProcess, 'CheckSolution', 'dedup')
+    timer.Wrap(fileprocess.FileProcess, 'SolutionRestore', 'store')
+    for name in ('New', 'SetStatus', 'WaitTurn'):
+        timer.Wrap(status.StatusManager, name, 'status')
+    backend_class = {"opt": optprocess.OptProcess, "qsub": qsubprocess.QsubProcess, "local": localprocess.LocalProcess}[backend]
+    timer.Wrap(backend_class, 'SendProcess', 'submit')
+    timer.Wrap(backend_class, 'GetProcess', 'poll')
+
+    start = time.perf_counter()
+    out = Main().Run(solutions)
+    total = time.perf_counter() - start
+
+    errors = sum(1 for item in out or [] if "error" in list(item.values())[0])
+    report = {
+        "backend": backend,
+        "batch": batch,
+        "history": history,
+        "seconds": total,
+        "throughput": batch / total if total else None,
+        "phases": {phase: timer.seconds.get(phase, 0.0) for phase in PHASES},
+        "errors": errors,
+        "returned": len(out or []),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    print(json.dumps(report))
+
+
+def Header():
+    # Print the header of the table of reports
+    header = f"{'batch':>7} {'history':>8} {'seconds':>9} {'sol/s':>9} " + " ".join(f"{p:>8}" for p in PHASES) + f" {'errors':>6} {'peakMB':>7}"
+    print(header)
+    print("-" * len(header))
+
+
+def Row(r):
+    # Print one report as a row of the table
+    print(f"{r['batch']:>7} {r['history']:>8} {r['seconds']:>9.3f} {r['throughput']:>9.1f} "
+          + " ".join(f"{r['phases'][p]:>8.3f}" for p in PHASES)
+          + f" {r['errors']:>6} {r['peak_memory_mb']:>7.1f}", flush=True)
+
+
+def Sizes(text):
+    return [int(s) for s in text.split(',') if s.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['opt', 'qsub', 'local'], default='opt')
+    parser.add_argument('--array', action='store_true', help='submit qsub job arrays')
+    parser.add_argument('--batches', type=Sizes, default=DEFAULT_BATCHES,
+                        help='batch sizes measured with an empty result store (comma separated)')
+    parser.add_argument('--histories', type=Sizes, default=DEFAULT_HISTORIES,
+                        help='numbers of stored results measured with --history-batch solutions (comma separated)')
+    parser.add_argument('--history-batch', type=int, default=DEFAULT_HISTORY_BATCH)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each fake command takes')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='probability that a fake command fails')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability that a fake opt evaluation fails')
+    parser.add_argument('--result-delay', type=float, default=0.0, help='seconds until an evaluation value is available')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds allowed for one measurement')
+    parser.add_argument('--json', help='also write the reports to this file')
+    args = parser.parse_args()
+
+    runs = [(b, 0) for b in args.batches] + [(args.history_batch, h) for h in args.histories]
+    reports = []
+    Header()
+    for batch, history in runs:
+        reports.append(Measure(args, batch, history))
+        Row(reports[-1])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=4)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--prefill':
+        Prefill(sys.argv[2], int(sys.argv[4]), int(sys.argv[5]))
+    elif len(sys.argv) > 1 and sys.argv[1] == '--child':
+        Child(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), int(sys.argv[5]))
+    else:
+        main()
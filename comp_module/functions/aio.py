@@ -0,0 +1,32 @@
+#!/usr/local/bin/python
+import asyncio
+from subprocess import CalledProcessError
+
+
+async def CheckOutput(args, input=None):
+    """Run a shell command without blocking the event loop and return its output.
+
+    Behaves like subprocess.check_output(args, shell=True, text=True, input=input).
+
+    Parameters
+    ----------
+    args (string):
+        Command to run
+    input (string):
+        Data written to the standard input of the command (optional)
+    """
+    process = await asyncio.create_subprocess_shell(
+        args,
+        stdin=asyncio.subprocess.PIPE if input is not None else None,
+        stdout=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, _ = await process.communicate(input.encode() if input is not None else None)
+    except asyncio.CancelledError:
+        # Do not leave the command running when the caller is cancelled
+        if process.returncode is None:
+            process.kill()
+        raise
+    if process.returncode != 0:
+        raise CalledProcessError(process.returncode, args, output=stdout.decode())
+    return stdout.decode()
@@ -0,0 +1,125 @@
+#!/usr/local/bin/python
+import json
+import math
+try:
+    from .columnstore import FloatRow
+except ImportError:
+    from columnstore import FloatRow
+
+# Default number of single-objective results kept by ResultArchive
+TOP_SIZE = 100
+
+
+def Dominates(a, b):
+    """Return True if the evaluation value a Pareto-dominates b (all objectives are minimized).
+
+    Parameters
+    ----------
+    a (list):
+        Evaluation value
+    b (list):
+        Evaluation value
+    """
+    return len(a) == len(b) and all(x <= y for x, y in zip(a, b)) and any(x < y for x, y in zip(a, b))
+
+
+class ResultArchive:
+    """Best results of a result store, updated as evaluation values are stored.
+
+    Multi-objective values are kept in a Pareto archive (the non-dominated values), and
+    single-objective values in a table of the `size` smallest values, so the best results
+    are read without scanning the store. Both tables are in the database of the result
+    store and are updated in its write transactions, so every process sees the same archive.
+    All objectives are minimized; values that are not numbers are ignored.
+
+    Parameters
+    ----------
+    size: int
+        Number of single-objective results kept (defaults to TOP_SIZE).
+    """
+    def __init__(self, size=None):
+        self.size = TOP_SIZE if size is None else size
+
+    @staticmethod
+    def CreateTables(conn):
+        """Create the tables of the archive in the database of the result store.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        """
+        conn.execute("CREATE TABLE IF NOT EXISTS front (key TEXT PRIMARY KEY, objective TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS best (key TEXT PRIMARY KEY, value REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS best_value ON best (value)")
+
+    def Add(self, conn, rows):
+        """Add newly stored evaluation values.
+
+        Must be called inside a write transaction of the result store.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        rows (iterable):
+            (key, objective) of each solution whose evaluation value was stored
+        """
+        # Non-dominated values {key: objective}, read once when the first multi-objective value arrives
+        front = None
+        for key, objective in rows:
+            y = FloatRow(objective)
+            if y is None or not all(math.isfinite(v) for v in y):
+                continue
+            if len(y) == 1:
+                self.__AddBest(conn, key, y[0])
+                continue
+            if front is None:
+                front = {k: json.loads(o) for k, o in conn.execute("SELECT key, objective FROM front")}
+            # Values equal to an archived one are not added
+            if key in front or any(f == y or Dominates(f, y) for f in front.values()):
+                continue
+            dominated = [k for k, f in front.items() if Dominates(y, f)]
+            conn.executemany("DELETE FROM front WHERE key = ?", [(k,) for k in dominated])
+            for k in dominated:
+                del front[k]
+            front[key] = y
+            conn.execute("INSERT INTO front (key, objective) VALUES (?, ?)", (key, json.dumps(y)))
+
+    def Front(self, conn):
+        """Return the keys of the non-dominated results, ordered by the first objective.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        """
+        front = [(json.loads(o), k) for k, o in conn.execute("SELECT key, objective FROM front")]
+        return [k for _, k in sorted(front)]
+
+    def Best(self, conn, k=None):
+        """Return the keys of the k results with the smallest single-objective values, best first.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        k (int):
+            Number of results (all kept results if not given)
+        """
+        return [key for key, in conn.execute(
+            "SELECT key FROM best ORDER BY value, rowid LIMIT ?", (-1 if k is None else k,)
+        )]
+
+    def __AddBest(self, conn, key, value):
+        # Keep the `size` smallest values; a value equal to the largest kept one is not added
+        if self.size <= 0 or conn.execute("SELECT 1 FROM best WHERE key = ?", (key,)).fetchone():
+            return
+        count, worst = conn.execute("SELECT COUNT(*), MAX(value) FROM best").fetchone()
+        if count >= self.size:
+            if value >= worst:
+                return
+            conn.execute(
+                "DELETE FROM best WHERE rowid = (SELECT rowid FROM best ORDER BY value DESC, rowid DESC LIMIT 1)"
+            )
+        conn.execute("INSERT INTO best (key, value) VALUES (?, ?)", (key, value))
@@ -0,0 +1,206 @@
+#!/usr/local/bin/python
+import math
+import mmap
+import os
+import time
+from array import array
+# NumPy is only needed to map the columns as arrays (memoryviews are returned without it)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Files of a column store: solutions (rows x dimension), evaluation values (rows x objectives)
+# and the time each evaluation value was stored (NaN until then)
+SOLUTIONS_FILE = "solutions.f64"
+OBJECTIVES_FILE = "objectives.f64"
+TIMES_FILE = "times.f64"
+# Bytes of one float64 value
+ITEM_SIZE = 8
+# Time of evaluation values stored before the columns existed or imported from files (not NaN, which means not received)
+UNKNOWN_TIME = -math.inf
+
+
+def FloatRow(value):
+    """Return a number or a flat list of numbers as a list of floats, or None for any other value.
+
+    Parameters
+    ----------
+    value:
+        Solution or evaluation value
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return [float(value)]
+    if isinstance(value, (list, tuple)) and value and all(
+        isinstance(v, (int, float)) and not isinstance(v, bool) for v in value
+    ):
+        return [float(v) for v in value]
+    return None
+
+
+class ColumnStore:
+    """Columnar copy of the numeric solutions of a result store.
+
+    Solutions, evaluation values and the times the values were stored are kept as
+    float64 matrices in plain binary files, one row per solution, so that they can be
+    memory-mapped and read without parsing. Rows are written in place with pwrite, and
+    row numbers are given out inside the write transaction of the result store, so
+    several processes can append to the same columns. The 'info' of each row stays in
+    the result store (the side table "columns" maps the rows to the keys of the results).
+
+    Only solutions that are flat lists of numbers with the dimension of the first stored
+    solution get a row; evaluation values that are not numbers (or have another number of
+    objectives) are stored as NaN.
+
+    Parameters
+    ----------
+    directory: string
+        Directory of the column files.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.__fds = {}
+
+    @staticmethod
+    def CreateTables(conn):
+        """Create the side table of the columns in the database of the result store.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        """
+        conn.execute("CREATE TABLE IF NOT EXISTS columns (row INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE)")
+
+    def Write(self, conn, rows, stored_at=None):
+        """Add new solutions and fill in missing evaluation values.
+
+        Must be called inside a write transaction of the result store.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        rows (list):
+            (key, solution, objective) of each solution
+        stored_at (float):
+            Time recorded for the evaluation values (the current time if not given,
+            UNKNOWN_TIME for values whose time is not known)
+        """
+        dimension, width = self.Shape(conn)
+        next_row = None
+        for key, solution, objective in rows:
+            x = FloatRow(solution) if isinstance(solution, (list, tuple)) else None
+            if x is None:
+                continue
+            if dimension is None:
+                dimension = len(x)
+                self.__SetMeta(conn, "columns_dimension", dimension)
+            if len(x) != dimension:
+                continue
+            found = conn.execute("SELECT row FROM columns WHERE key = ?", (key,)).fetchone()
+            if found is None:
+                if next_row is None:
+                    next_row = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM columns").fetchone()[0]
+                row, next_row = next_row, next_row + 1
+                conn.execute("INSERT INTO columns (row, key) VALUES (?, ?)", (row, key))
+                os.pwrite(self.__Fd(SOLUTIONS_FILE), array('d', x).tobytes(), row * dimension * ITEM_SIZE)
+                os.pwrite(self.__Fd(TIMES_FILE), array('d', [math.nan]).tobytes(), row * ITEM_SIZE)
+                if width is not None:
+                    os.pwrite(self.__Fd(OBJECTIVES_FILE), array('d', [math.nan] * width).tobytes(), row * width * ITEM_SIZE)
+            else:
+                row = found[0]
+                # Values that are already stored are kept
+                stored = array('d', os.pread(self.__Fd(TIMES_FILE), ITEM_SIZE, row * ITEM_SIZE))
+                if not math.isnan(stored[0]):
+                    continue
+            if objective is None:
+                continue
+            y = FloatRow(objective)
+            if width is None:
+                if y is None:
+                    continue
+                width = len(y)
+                self.__SetMeta(conn, "columns_objectives", width)
+                # Rows added before the number of objectives was known have no values yet
+                count = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM columns").fetchone()[0]
+                os.pwrite(self.__Fd(OBJECTIVES_FILE), array('d', [math.nan] * (count * width)).tobytes(), 0)
+            if y is None or len(y) != width:
+                y = [math.nan] * width
+            os.pwrite(self.__Fd(OBJECTIVES_FILE), array('d', y).tobytes(), row * width * ITEM_SIZE)
+            os.pwrite(self.__Fd(TIMES_FILE), array('d', [time.time() if stored_at is None else stored_at]).tobytes(), row * ITEM_SIZE)
+
+    def Shape(self, conn):
+        """Return (dimension, number of objectives); each is None until the first one is stored.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+        """
+        meta = dict(conn.execute(
+            "SELECT name, value FROM meta WHERE name IN ('columns_dimension', 'columns_objectives')"
+        ).fetchall())
+        dimension = meta.get("columns_dimension")
+        width = meta.get("columns_objectives")
+        return (None if dimension is None else int(dimension)), (None if width is None else int(width))
+
+    def Read(self, conn):
+        """Memory-map the columns.
+
+        The mappings are shared with the files, so evaluation values stored later
+        (also by other processes) appear in them; rows added later do not.
+
+        Parameters
+        ----------
+        conn (sqlite3.Connection):
+            Connection to the result store
+
+        Returns
+        --------
+        solutions:
+            Solutions, shape (rows, dimension)
+        objectives:
+            Evaluation values, shape (rows, objectives), NaN if not received
+            (None while no evaluation value is stored)
+        times:
+            Time each evaluation value was stored, shape (rows,), NaN if not received
+            and UNKNOWN_TIME (-inf) if the time is not known
+
+        The columns are numpy arrays if NumPy is installed and memoryviews otherwise.
+        """
+        dimension, width = self.Shape(conn)
+        count = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM columns").fetchone()[0]
+        solutions = self.__Map(SOLUTIONS_FILE, count, dimension or 0)
+        objectives = None if width is None else self.__Map(OBJECTIVES_FILE, count, width)
+        times = self.__Map(TIMES_FILE, count, None)
+        return solutions, objectives, times
+
+    def Close(self):
+        for fd in self.__fds.values():
+            os.close(fd)
+        self.__fds.clear()
+
+    def __Fd(self, name):
+        # Column files stay open for the life of the store
+        if name not in self.__fds:
+            self.__fds[name] = os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, 0o644)
+        return self.__fds[name]
+
+    def __Map(self, name, count, width):
+        # Map count rows of a column file (width None: a single column)
+        shape = (count,) if width is None else (count, width)
+        size = count * (width or 1) * ITEM_SIZE
+        path = os.path.join(self.directory, name)
+        if size == 0:
+            return np.empty(shape) if np is not None else memoryview(array('d'))
+        if np is not None:
+            return np.memmap(path, dtype=np.float64, mode='r', shape=shape)
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast('d', list(shape))
+
+    @staticmethod
+    def __SetMeta(conn, name, value):
+        conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, str(value)))
@@ -0,0 +1,36 @@
+#!/usr/local/bin/python
+import os
+import copy
+import json
+import threading
+
+# Variable to store the file directory path
+FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Path to the configuration file
+CONFIGFILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files/__config.json'))
+
+# Parsed configuration files: {path: ((modification time, size), settings)}
+_cache = {}
+_lock = threading.Lock()
+
+
+def LoadConfig(path=CONFIGFILE):
+    """Return the settings of the configuration file.
+
+    The file is parsed once and kept in memory until it is modified, so that
+    long-running processes do not read it again for every run.
+
+    Parameters
+    ----------
+    path (string):
+        Path to the configuration file
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _cache.get(path)
+        if cached is None or cached[0] != version:
+            with open(path, 'r') as f:
+                cached = _cache[path] = (version, json.load(f))
+    # Callers may change their copy
+    return copy.deepcopy(cached[1])
@@ -0,0 +1,265 @@
+#!/usr/local/bin/python
+try:
+    from .scheduler import Scheduler
+    from .status import StatusManager
+    from .history import History
+    from .fileprocess import FileProcess
+    from .journal import SendJournal
+except ImportError:
+    from scheduler import Scheduler
+    from status import StatusManager
+    from history import History
+    from fileprocess import FileProcess
+    from journal import SendJournal
+import socketserver
+import threading
+import socket
+import json
+import os
+
+# Variable to store the file directory path
+FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Path to the socket of the daemon
+SOCKET_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files/__ecow.sock'))
+
+
+class Daemon:
+    """Long-running process that serves Run, status and history requests over a Unix domain socket.
+
+    The configuration, the in-memory result caches and the run queue stay alive between
+    requests, so a request does not pay for starting Python and rebuilding them, and the
+    daemon is the only process writing the result and status files while clients use it.
+
+    Requests and responses are one JSON object per line:
+    {"op": "run", "values": [...], "target": ..., "wait": ...}, {"op": "resume"}, {"op": "status"},
+    {"op": "history", "match_id": ..., "output": ...}, {"op": "front", "target": ..., "k": ...},
+    {"op": "ping"} and {"op": "shutdown"};
+    the response is {"ok": true, "result": ...} or {"ok": false, "error": ...}.
+    {"op": "iter", "values": [...], "target": ...} is answered with {"ok": true, "item": ...} for each
+    evaluation value as soon as it is received, followed by {"ok": true, "done": true}.
+
+    Parameters
+    ----------
+    path: string
+        Path to the socket (SOCKET_FILE if not given).
+    workers: int
+        Maximum number of runs at the same time (scheduler.workers if not given).
+    per_target: int
+        Maximum number of runs at the same time for one recipient (scheduler.per_target if not given).
+    """
+    def __init__(self, path=None, workers=None, per_target=None):
+        self.path = path or SOCKET_FILE
+        self.scheduler = Scheduler(workers, per_target)
+        self.__server = None
+
+    def Serve(self):
+        """Serve requests until a shutdown request or Ctrl-C."""
+        if DaemonClient(self.path).Running():
+            raise RuntimeError(f"A daemon is already running on {self.path}")
+        if os.path.exists(self.path):
+            # Left behind by a daemon that did not exit cleanly
+            os.remove(self.path)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        request = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        self.Send({"ok": False, "error": f"{e.__class__.__name__}: {e}"})
+                        continue
+                    if request.get("op") == "iter":
+                        self.Stream(request)
+                    else:
+                        self.Send(daemon.Handle(request))
+
+            def Send(self, response):
+                self.wfile.write((json.dumps(response) + "\n").encode())
+                self.wfile.flush()
+
+            def Stream(self, request):
+                # Send each evaluation value as soon as it is received; if the client stops
+                # reading, closing the run keeps the solutions not yet received for Resume
+                items = daemon.Iter(request)
+                try:
+                    for response in items:
+                        self.Send(response)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped the iteration
+                    pass
+                finally:
+                    items.close()
+
+        self.__server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.__server.daemon_threads = True
+        # Only the owner may send requests
+        os.chmod(self.path, 0o600)
+        print(f"ECOW daemon listening on {self.path}")
+        try:
+            self.__server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.__server.server_close()
+            self.scheduler.Shutdown(wait=False)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def Handle(self, request):
+        """Answer one request and return the response.
+
+        Parameters
+        ----------
+        request (dict):
+            {"op": ..., parameters of the request}
+        """
+        try:
+            op = request.get("op")
+            if op == "run":
+                future = self.scheduler.Submit(request.get("values"), request.get("target"))
+                # With "wait": false the run goes on in the daemon after the response (Run(no_wait=True))
+                result = future.result() if request.get("wait", True) else None
+            elif op == "resume":
+                result = self.Resume()
+            elif op == "status":
+                result = StatusManager.Report()
+            elif op == "history":
+                result = History().Report(request["match_id"], request.get("output") or '')
+            elif op == "front":
+                result = FileProcess(resultID=request["target"]).ArchiveReport(request.get("k"))
+            elif op == "ping":
+                result = os.getpid()
+            elif op == "shutdown":
+                # serve_forever runs in another thread, so it can be stopped from here
+                threading.Thread(target=self.__server.shutdown).start()
+                result = None
+            else:
+                raise ValueError(f"Unknown request: {op}")
+            return {"ok": True, "result": result}
+        except Exception as e:
+            return {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+
+
+    def Iter(self, request):
+        """Yield the responses to an "iter" request: one for each evaluation value, then the end.
+
+        Parameters
+        ----------
+        request (dict):
+            {"op": "iter", "values": ..., "target": ...}
+        """
+        try:
+            for item in self.scheduler.Stream(request.get("values"), request.get("target")):
+                yield {"ok": True, "item": item}
+        except (Exception, SystemExit) as e:
+            yield {"ok": False, "error": f"{e.__class__.__name__}: {e}"}
+            return
+        yield {"ok": True, "done": True}
+
+    def Resume(self):
+        """Receive the evaluation values of solutions sent by runs that ended before receiving them.
+
+        Returns
+        --------
+        results (dict):
+            {recipient: list of evaluation values (None if it failed)} for each resumed recipient
+        """
+        results = {}
+        # Resumed runs count against the limits of the scheduler like the other runs
+        futures = {}
+        for recipient in SendJournal.Recipients():
+            try:
+                futures[recipient] = self.scheduler.Submit(None, recipient, resume=True)
+            except Exception as e:
+                print(f"{e.__class__.__name__}: {e}")
+                results[recipient] = None
+        for recipient, future in futures.items():
+            try:
+                results[recipient] = future.result()
+            except Exception as e:
+                print(f"{e.__class__.__name__}: {e}")
+                results[recipient] = None
+        return results
+
+
+class DaemonClient:
+    """Sends requests to the daemon.
+
+    Parameters
+    ----------
+    path: string
+        Path to the socket (SOCKET_FILE if not given).
+    """
+    def __init__(self, path=None):
+        self.path = path or SOCKET_FILE
+
+    def Running(self):
+        """Return True if a daemon answers on the socket."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            self.Call("ping")
+        except (OSError, RuntimeError):
+            return False
+        return True
+
+    def Call(self, op, **params):
+        """Send one request and return its result.
+
+        Parameters
+        ----------
+        op (string):
+            "run", "resume", "status", "history", "front", "ping" or "shutdown"
+        params:
+            Parameters of the request
+
+        Raises
+        --------
+        OSError:
+            If the daemon cannot be reached
+        RuntimeError:
+            If the daemon could not complete the request
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self.path)
+            conn.sendall((json.dumps(dict(params, op=op)) + "\n").encode())
+            with conn.makefile('rb') as f:
+                line = f.readline()
+        if not line:
+            raise RuntimeError("The daemon closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def Iter(self, **params):
+        """Send an "iter" request and yield each evaluation value as soon as the daemon receives it.
+
+        Stopping the iteration closes the connection, and the daemon keeps the solutions
+        not yet received for Resume.
+
+        Parameters
+        ----------
+        params:
+            Parameters of the request ("values" and "target")
+
+        Raises
+        --------
+        OSError:
+            If the daemon cannot be reached
+        RuntimeError:
+            If the daemon could not complete the request
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(self.path)
+            conn.sendall((json.dumps(dict(params, op="iter")) + "\n").encode())
+            with conn.makefile('rb') as f:
+                for line in f:
+                    response = json.loads(line)
+                    if not response["ok"]:
+                        raise RuntimeError(response["error"])
+                    if response.get("done"):
+                        return
+                    yield response["item"]
+        raise RuntimeError("The daemon closed the connection")
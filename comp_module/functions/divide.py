@@ -1,14 +1,26 @@
 #!/usr/local/bin/python
 import os
+import copy
 import json
-import time
+import asyncio
 import subprocess
 import argparse
-from optprocess import OptProcess
-from qsubprocess import QsubProcess
-from fileprocess import FileProcess
-from status import StatusManager, StatusEnum
-from filelock import FileLock
+try:
+    from .optprocess import OptProcess, SEND_WORKERS, GET_PAGE_SIZE
+    from .qsubprocess import QsubProcess
+    from .localprocess import LocalProcess
+    from .fileprocess import FileProcess
+    from .status import StatusManager, StatusEnum
+    from .journal import SendJournal
+    from .config import LoadConfig
+except ImportError:
+    from optprocess import OptProcess, SEND_WORKERS, GET_PAGE_SIZE
+    from qsubprocess import QsubProcess
+    from localprocess import LocalProcess
+    from fileprocess import FileProcess
+    from status import StatusManager, StatusEnum
+    from journal import SendJournal
+    from config import LoadConfig
 
 class Process:
     # Variable to store the file directory path
@@ -18,47 +30,51 @@ class Process:
     # Path to the file storing solutions (used when the solution file is not specified as an option)
     DEFAULT_SENDFILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files/__send_data.json'))
     
-    UNRECEIVE_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__error_files/UnReceiveData.json'))
     
-    LOCKFILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './.opt.lock'))
-    
-    
-    def __init__(self, filepath=DEFAULT_SENDFILE):
-        # 再受信機能実装予定 (qsub未実装)=================================
+    def __init__(self, filepath=DEFAULT_SENDFILE, values=None, argv=None, target=None, slots=None):
+        """
+        Parameters
+        ----------
+        filepath: string
+            Path to the file storing solutions.
+        values: list
+            Solutions to send (read from the solution file if not given).
+        argv: list
+            Command line arguments (sys.argv is used if not given).
+        target: string
+            Recipient to send to instead of the one in the configuration file:
+            "opt_<matchID>", "qsub_<name>", "qsub_<name>_<model>" or "local".
+            Also given by the -t option.
+        slots: int
+            Number of runs for the recipient allowed at the same time (scheduler.per_target if not given).
+        """
+        # -re: receive the evaluation values of the solutions in the journals of ended runs instead of sending
         parser = argparse.ArgumentParser() 
         parser.add_argument('-re', '--receiveAgain', action='store_true',default=False)
-        self.args = parser.parse_args()
+        parser.add_argument('-t', '--target', action='store', default=None)
+        self.args = parser.parse_args(argv)
+        if target is None:
+            target = self.args.target
         
         # Receive Opt user ID and password from the file here
-        json_load = json.load(open(self.CONFIGFILE, 'r'))
-        main_json = json_load['main']
+        json_load = LoadConfig(self.CONFIGFILE)
+        main_json = json_load['main'] if target is None else Process.Target(json_load['main'], target)
+        # Settings of the polling interval shared by both recipients
+        polling = json_load.get('polling')
+        # Limits of the submit and poll commands of each recipient
+        rate = json_load.get('rate')
+        # Number of runs for the same recipient allowed at the same time
+        if slots is None:
+            slots = json_load.get('scheduler', {}).get('per_target', 1)
+        # Tolerance for treating a solution as already sent (None: only exactly equal solutions)
+        tolerance = (json_load.get('duplicate') or {}).get('tolerance')
+        # Number of results kept in memory for each result store
+        cache_size = (json_load.get('cache') or {}).get('size')
+        # Keep the numeric solutions as memory-mappable columns beside the result store
+        columns = (json_load.get('store') or {}).get('columns', True)
+        # Number of single-objective results kept by the archive of the best results
+        top = (json_load.get('store') or {}).get('top')
         
-        if self.args.receiveAgain:
-            json_load = json.load(open(self.UNRECEIVE_FILE),'r')
-            # キーの取得
-            keys = list(json_load.keys())
-            tmp = keys[0].split('_')
-            datum = json_load[keys[0]]
-            # create list of ids
-            id_list = [item['id'] for item in datum]
-            # create list of values
-            value_list = [item['value'] for item in datum]
-            sub_to = tmp[0] 
-            if sub_to == 'opt':
-                user_name = main_json[sub_to]['user_name']
-                match_id = tmp[2]
-                script = main_json[sub_to]["script"]
-                fp = FileProcess(filepath, f"{sub_to}_{match_id}")
-                self.sm = StatusManager(f"{sub_to}_{match_id}")
-                opt = OptProcess(self.sm, fp, int(match_id), user_name, script,send_id_list=id_list,send_value_list=value_list)
-                self.__getProcess = opt.GetProcess
-            else:
-                qsub_sub_to = tmp[2]
-                qsub_json = main_json[self.sub_to][qsub_sub_to]
-                script = qsub_json["script"]
-                if len(tmp) > 2:
-                    model = tmp[3]
-                
         self.sub_to = main_json['sub_to']
         
         # Store functions as variables
@@ -67,11 +83,25 @@ class Process:
             user_name = main_json[self.sub_to]['user_name']
             match_id = main_json[self.sub_to]['match_id']
             script = main_json[self.sub_to]["script"]
-            fp = FileProcess(filepath, f"{self.sub_to}_{match_id}")
-            self.sm = StatusManager(f"{self.sub_to}_{match_id}")
-            opt = OptProcess(self.sm, fp, int(match_id), user_name, script)
+            fp = FileProcess(filepath, f"{self.sub_to}_{match_id}", tolerance, cache_size, columns, top)
+            self.sm = StatusManager(f"{self.sub_to}_{match_id}", slots)
+            workers = main_json[self.sub_to].get("workers", SEND_WORKERS)
+            page = main_json[self.sub_to].get("page", GET_PAGE_SIZE)
+            opt = OptProcess(self.sm, fp, int(match_id), user_name, script, workers=workers, polling=polling, page=page, rate=rate)
             self.__sendProcess = opt.SendProcess
             self.__getProcess = opt.GetProcess
+            self.__getIter = opt.GetIter
+            self.backend = opt
+        elif self.sub_to == 'local':
+            # If the argument is 'local'
+            local_json = main_json[self.sub_to]
+            fp = FileProcess(filepath, self.sub_to, tolerance, cache_size, columns, top)
+            self.sm = StatusManager(self.sub_to, slots)
+            local = LocalProcess(self.sm, fp, local_json["cmd"], workers=local_json.get("workers"))
+            self.__sendProcess = local.SendProcess
+            self.__getProcess = local.GetProcess
+            self.__getIter = local.GetIter
+            self.backend = local
         else:
             # If the argument is 'qsub'
             qsub_sub_to = main_json[self.sub_to]['sub_to']
@@ -83,16 +113,56 @@ class Process:
             else:
                 match_id = None
                 filename = f"{self.sub_to}_{qsub_sub_to}"
-            fp = FileProcess(filepath, filename)
-            self.sm = StatusManager(filename)
-            qsub = QsubProcess(self.sm, fp, script, match_id)
+            fp = FileProcess(filepath, filename, tolerance, cache_size, columns, top)
+            self.sm = StatusManager(filename, slots)
+            qsub = QsubProcess(self.sm, fp, script, match_id, polling=polling, array=qsub_json.get("array"), rate=rate)
             self.__sendProcess = qsub.SendProcess
             self.__getProcess = qsub.GetProcess
+            self.__getIter = qsub.GetIter
+            self.backend = qsub
             
         # Pass the file path containing the solutions to be sent to the file processing class and instantiate it
         # Also pass this variable when instantiating the class that will perform the sending process
-        self.sendList = fp.getValue(self.DEFAULT_SENDFILE)
+        if self.args.receiveAgain:
+            # Journals of the ended runs for this recipient (locked so that they are resumed only once)
+            self.journals = SendJournal.Pending(self.sm.recipient)
+            self.sendList = []
+        elif values is None:
+            self.sendList = fp.getValue(self.DEFAULT_SENDFILE)
+        else:
+            self.sendList = FileProcess.FormatValues(values)
         
+    @staticmethod
+    def Target(main_json, target):
+        """Return a copy of the "main" settings that sends to the given recipient.
+
+        Parameters
+        ----------
+        main_json (dict):
+            "main" settings of the configuration file
+        target (string):
+            "opt_<matchID>", "qsub_<name>", "qsub_<name>_<model>" or "local"
+        """
+        main_json = copy.deepcopy(main_json)
+        parts = str(target).split('_', 2)
+        sub_to = parts[0]
+        if sub_to not in main_json:
+            raise ValueError(f"Unknown target: {target}")
+        main_json['sub_to'] = sub_to
+        if sub_to == 'opt':
+            if len(parts) != 2:
+                raise ValueError(f"Target of opt must be opt_<matchID>: {target}")
+            main_json['opt']['match_id'] = parts[1]
+        elif sub_to == 'qsub':
+            if len(parts) < 2 or parts[1] not in main_json['qsub']:
+                raise ValueError(f"Unknown qsub target: {target}")
+            main_json['qsub']['sub_to'] = parts[1]
+            if len(parts) == 3:
+                main_json['qsub'][parts[1]]['model'] = parts[2]
+            else:
+                main_json['qsub'][parts[1]].pop('model', None)
+        return main_json
+
     # Send
     def Send(self, datalist):
         # Sending process
@@ -102,12 +172,17 @@ class Process:
     def Get(self):
         # Receive process and get evaluation value
         return self.__getProcess()
+
+    # Receive one by one
+    def GetIter(self):
+        # Yield each evaluation value as soon as it is received
+        return self.__getIter()
     
     # History
     def History(self):
         # Display using print
         # Enter matchID or job ID to display
-        json_load = json.load(open(self.CONFIGFILE, 'r'))
+        json_load = LoadConfig(self.CONFIGFILE)
         user_name = json_load['opt']['user_name']
         print("1: matchID 2: time")
         select = input()
@@ -124,35 +199,106 @@ class Process:
             result = ["variable:" + x['variable'] + ", objective:" + x['objective'] for x in search_data['solutions']]
             print(result)
     
+    # Wait for the turn of this run
+    def __Wait(self):
+        # Join the queue of the recipient and sleep until the previous run has finished
+        self.sm.New(StatusEnum.WAITING)
+        with self.backend.metrics.Phase("wait"):
+            self.sm.WaitTurn()
+
+    # Record the timings of this run in the metrics log
+    def __SaveMetrics(self):
+        self.sm.SaveMetrics(self.backend.metrics.Summary())
+
+    # Reattach to the solutions of ended runs
+    def __Resume(self):
+        # The solutions are already submitted, so this run does not wait for its turn
+        entries = [e for journal in self.journals for e in journal.Entries()]
+        self.sm.New(StatusEnum.SOLUTION_SENT)
+        # The runs that wrote the journals ended before receiving every evaluation value
+        self.sm.SetExited([journal.run for journal in self.journals if journal.run is not None])
+        self.backend.Resume(entries)
+        # The entries are now in the journal of this run
+        for journal in self.journals:
+            journal.Remove()
+
     # Execute
     def run(self):
-        # not reacquired
-        if not self.args.receiveAgain:
-            try:
-                if self.sub_to == 'opt':
-                    # Create a file lock
-                    lock = FileLock(self.LOCKFILE)
-                    with lock:
-                        # Place the main logic of the script here
-                        time.sleep(10)
-                # Wait until the previous evaluation value is returned
-                self.sm.New(StatusEnum.WAITING)
-                while True:
-                    if self.sm.CheckStatus():
-                        break
+        try:
+            if self.args.receiveAgain:
+                # reacquire
+                self.__Resume()
+            else:
+                self.__Wait()
                 # Execute
                 self.Send(self.sendList)
-                return self.Get()
-            except KeyboardInterrupt:
-                self.sm.SetStatus(StatusEnum.EXITED_WITH_CtrlC)
-        else : 
-            # reacquire
-            result = self.Get()
-            if self.sm.NowStatus() == StatusEnum.EVALUATION_RECEIVED:
-                os.remove(self.UNRECEIVE_FILE_PATH)
-            return result
+            return self.Get()
+        except KeyboardInterrupt:
+            self.sm.SetStatus(StatusEnum.EXITED_WITH_CtrlC)
+        finally:
+            self.__SaveMetrics()
+
+    # Execute and yield each evaluation value as soon as it is received
+    def runIter(self):
+        try:
+            if self.args.receiveAgain:
+                self.__Resume()
+            else:
+                self.__Wait()
+                # Execute
+                self.Send(self.sendList)
+            yield from self.GetIter()
+        except KeyboardInterrupt:
+            self.sm.SetStatus(StatusEnum.EXITED_WITH_CtrlC)
+        finally:
+            self.__SaveMetrics()
+
+    # Wait for the turn of this run without blocking the event loop
+    async def __WaitAsync(self):
+        # Join the queue of the recipient and sleep in a thread so that other tasks keep running
+        self.sm.New(StatusEnum.WAITING)
+        try:
+            with self.backend.metrics.Phase("wait"):
+                await asyncio.to_thread(self.sm.WaitTurn)
+        except asyncio.CancelledError:
+            self.sm.SetStatus(StatusEnum.EXITED_WITH_CtrlC)
+            raise
+
+    # Execute with asyncio
+    async def runAsync(self, futures):
+        """Send the solutions and set each result to the future at the same position.
+
+        Parameters
+        ----------
+        futures (list):
+            asyncio.Future for each solution of sendList
+        """
+        try:
+            if self.args.receiveAgain:
+                self.__Resume()
+            else:
+                await self.__WaitAsync()
+                try:
+                    await self.backend.SendProcessAsync(self.sendList)
+                except asyncio.CancelledError:
+                    self.sm.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
+                    raise
+            async for n, item in self.backend.ReceiveAsync():
+                if not futures[n].done():
+                    futures[n].set_result(item)
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except BaseException as e:
+            # Pass the error to everyone waiting for a result
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError(f"{e.__class__.__name__}: {e}"))
+        finally:
+            self.__SaveMetrics()
 
 if __name__=='__main__':
     p = Process()
     result = p.run()
-    print(result)
\ No newline at end of file
+    print(result)
@@ -1,6 +1,18 @@
 #!/usr/local/bin/python
 import json
 import os
+import threading
+try:
+    from .resultstore import ResultStore, ResultCache, CanonicalKey, CACHE_SIZE
+    from .nearindex import NearIndex
+except ImportError:
+    from resultstore import ResultStore, ResultCache, CanonicalKey, CACHE_SIZE
+    from nearindex import NearIndex
+# NumPy is only needed for array results (ResultArrays, Evaluations)
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 NO_EXISTING = None
 
@@ -10,12 +22,18 @@ class FileProcess:
     FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     # Append matchID or jobID to the end of the saved file name
     RESULT_RESTORE_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__results_files/ResultFile.json'))
+    # Indexed store of the results (the JSON result file is imported into it once)
+    RESULT_STORE_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__results_files/ResultFile.db'))
     # File path where the solution to be sent is stored
     SEND_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files/__send_data.json'))
-    # File path where unsubmitted solutions are stored
-    UNRECEIVE_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__error_files/UnReceiveData.json'))
+    # In-memory caches of the result stores, shared by all instances in this process
+    __caches = {}
+    # Near-duplicate indexes of the result stores, shared by all instances in this process:
+    # {(result store file, tolerance): [NearIndex, sequence number of the last added solution, lock]}
+    __nears = {}
+    __nears_lock = threading.Lock()
 
-    def __init__(self, sendfile=SEND_FILE, resultID=RESULT_RESTORE_FILE):
+    def __init__(self, sendfile=SEND_FILE, resultID=RESULT_RESTORE_FILE, tolerance=None, cache_size=None, columns=True, top=None):
         """
         Classes that work with files
 
@@ -25,11 +43,35 @@ class FileProcess:
             Defaults to SEND_FILE.
         resultID: string
             efaults to RESULT_RESTORE_FILE.
+        tolerance: float or list
+            Tolerance (for all dimensions or for each dimension) within which a solution
+            is treated as already sent. Only exactly equal solutions are detected if not given.
+        cache_size: int
+            Maximum number of results kept in memory for this result store (defaults to CACHE_SIZE).
+        columns: bool
+            Also keep the numeric solutions as memory-mappable columns (see ResultStore.Columns).
+        top: int
+            Number of single-objective results kept by the archive of the best results (see ResultStore.Best).
         """
         self.send_data = self.getValue(sendfile)
         self.resultID = resultID
         if resultID is not self.RESULT_RESTORE_FILE:
             self.RESULT_RESTORE_FILE = os.path.normpath(os.path.join(self.FILE_DIRECTORY, f'./__results_files/resultFile_{resultID}.json'))
+            self.RESULT_STORE_FILE = os.path.normpath(os.path.join(self.FILE_DIRECTORY, f'./__results_files/resultFile_{resultID}.db'))
+        self.__store = None
+        self.columns = columns
+        self.top = top
+        # The cache outlives this instance, so repeated runs in the same process share it
+        self.cache = FileProcess.__caches.setdefault(self.RESULT_STORE_FILE, ResultCache(CACHE_SIZE if cache_size is None else cache_size))
+        # Tolerance for near-duplicate detection (the index is created on first use)
+        self.tolerance = tolerance
+
+    @property
+    def store(self):
+        """Indexed result store, opened on first use."""
+        if self.__store is None:
+            self.__store = ResultStore(self.RESULT_STORE_FILE, legacy_file=self.RESULT_RESTORE_FILE, columns=self.columns, top=self.top)
+        return self.__store
 
     def CheckSolution(self, values: list):
         """When sending a solution, check if it has already been sent.
@@ -46,54 +88,45 @@ class FileProcess:
         previously (list):
             A data list that stores the results of solutions that have already been sent.
         """
-        # Variable to store the result of the already submitted solution
-        previously = [NO_EXISTING for _ in values]
         # Variable to store the data list to send
         add_data = []
-        # Perform the check process only if the following conditions are met
-        # 1. Save file exists
-        # 2. The contents of the saved file are not empty
-        if os.path.exists(self.RESULT_RESTORE_FILE) and os.path.getsize(self.RESULT_RESTORE_FILE) != 0:
-            # Get data (saved data) from the saved file
-            with open(self.RESULT_RESTORE_FILE, 'r') as file:
-                    now_data = json.load(file)
-
-            # Store only keys of saved data in list
-            solutions_list = [list(d.keys())[0] for d in now_data]
-            now_list = []
-            for s in solutions_list:
-                item_list = eval(s)
-                if isinstance(item_list, list):
-                    now_list.append(item_list)
-
-            # Store solutions that are not in the saved data in the list as data to be sent
-            add_data = [v for v in values if v not in now_list]
-            # Solutions that existed in the saved data are stored in the list as existing data
-            previously = [v for v in values if v in now_list]
-            
-            # If there is existing data, retrieve the corresponding results from the saved file.
-            if previously:
-                target_keys = previously.copy()
-                # Convert list to string
-                converted_keys = [str(key) for key in target_keys]
-                # Extract only elements with specified key
-                previously.clear()
-                for converted_key in converted_keys:
-                    tmp_item = None
-                    for item in now_data:
-                        if converted_key in item:
-                            tmp_item = item
-                            break
-                    previously.append(tmp_item)
-            else:
-                # If there is no existing data, store None for the number of solutions to be sent.
-                for _ in values:
-                    previously.append(NO_EXISTING)
-
-            return add_data, previously
-        else:
-            add_data = values
-            return add_data, previously
+        # Variable to store the result of the already submitted solution
+        previously = []
+        for v in values:
+            key = CanonicalKey(v)
+            # Results evaluated earlier in this process are found without reading the store
+            item = self.cache.Get(key)
+            if item is NO_EXISTING:
+                item = self.store.Lookup(v, key)
+                if item is not NO_EXISTING:
+                    self.cache.Put(key, item)
+            if item is NO_EXISTING and self.tolerance:
+                # Serve a solution within the tolerance of a stored one from the store
+                item = self.__LookupNear(v)
+            if item is NO_EXISTING:
+                # Store solutions that are not in the saved data in the list as data to be sent
+                add_data.append(v)
+            previously.append(item)
+        return add_data, previously
+
+    def __LookupNear(self, value):
+        # Return the stored result of the nearest solution within the tolerance, labelled with value
+        # The index outlives this instance, so later runs in the same process only add new solutions
+        key = (self.RESULT_STORE_FILE, json.dumps(self.tolerance))
+        with FileProcess.__nears_lock:
+            if key not in FileProcess.__nears:
+                FileProcess.__nears[key] = [NearIndex(self.tolerance), 0, threading.Lock()]
+            shared = FileProcess.__nears[key]
+        with shared[2]:
+            # Add the solutions stored since the last lookup (including those of other processes)
+            for seq, solution in self.store.Solutions(after=shared[1]):
+                shared[0].Add(solution)
+                shared[1] = seq
+            near = shared[0].Find(value)
+        if near is None:
+            return NO_EXISTING
+        item = self.store.Lookup(near)
+        return {str(value): list(item.values())[0]}
 
     def SolutionRestore(self, datum, values = None, info = None):
         """Save evaluation values for sent solutions.
@@ -108,55 +141,76 @@ class FileProcess:
             'info' of received evaluation value data item
         """
         if values is None:
-            values = []
-            for _ in datum:
-                values.append(NO_EXISTING)
+            values = [NO_EXISTING for _ in datum]
         
         if info is None:
-            info = []
-            for _ in datum:
-                info.append(NO_EXISTING)
+            info = [NO_EXISTING for _ in datum]
         
-        # Prepare data for storage
-        add_data = [{str(s): {"objective": v, "info": i}} for s, v, i in zip(datum, values, info)]
+        # Add new solutions and fill in missing values of existing ones
+        self.store.Upsert(datum, values, info)
+        for d, v, i in zip(datum, values, info):
+            self.cache.Put(CanonicalKey(d), {str(d): {"objective": v, "info": i}})
 
-        # If the save file does not exist, generate it
-        if not os.path.exists(self.RESULT_RESTORE_FILE) or os.path.getsize(self.RESULT_RESTORE_FILE) == 0:
-            self.NewCreateFile(self.RESULT_RESTORE_FILE, add_data)
-        else:
-            with open(self.RESULT_RESTORE_FILE, 'r') as f:
-                now_data = json.load(f)
-                
-            # Add only data that does not exist in the existing data
-            for data in add_data:
-                key = list(data.keys())[0]
-                # If there is no data in the solution save file
-                if key not in [list(d.keys())[0] for d in now_data]:
-                    now_data.append(data)
-                else:
-                    # If there is data in the solution save file
-                    # If the required key value is None, replace it with a new value
-                    for d in now_data:
-                        # get list of keys
-                        keys = list(d.keys())
-                        # Access the value using the first key
-                        first_key = keys[0]
-                        # Get the required key
-                        nested_data = d[first_key]
-                        # Get list of keys as a list
-                        nested_keys = list(nested_data.keys())
-                        for nested_key in nested_keys:
-                            if nested_data[nested_key] is None:
-                                # Update the data if the required data is None
-                                for i in range(len(add_data)):
-                                    if first_key in add_data[i]:
-                                        change_index = i
-                                        nested_data[nested_key] = add_data[change_index][first_key][nested_key]
-                        d[first_key] = nested_data
-
-            # Write JSON data to the file
-            with open(self.RESULT_RESTORE_FILE, 'w') as f:
-                json.dump(now_data, f, indent=4)
+    def Front(self):
+        """Return the non-dominated results of multi-objective evaluation values (see ResultStore.Front)."""
+        return self.store.Front()
+
+    def Best(self, k=None):
+        """Return the results with the smallest single-objective evaluation values (see ResultStore.Best).
+
+        Parameters
+        ----------
+        k (int):
+            Number of results (all results kept by the archive if not given)
+        """
+        return self.store.Best(k)
+
+    def ArchiveReport(self, k=None):
+        """Return the Pareto front and the best results as text.
+
+        Parameters
+        ----------
+        k (int):
+            Number of single-objective results shown (all results kept by the archive if not given)
+        """
+        lines = []
+        for title, entries in (("Pareto front", self.Front()), ("Best", self.Best(k))):
+            if not entries:
+                continue
+            lines.append(f"{title} ({len(entries)})")
+            lines.append("-" * 45)
+            for entry in entries:
+                label, item = list(entry.items())[0]
+                lines.append(f"{'objective':<15} : {item['objective']}")
+                lines.append(f"{'variable':<15} : {label}")
+                lines.append(f"{'info':<15} : {item['info']}")
+                lines.append("-" * 45)
+        if not lines:
+            lines.append("No evaluation values have been stored")
+        return "\n".join(lines)
+
+    @staticmethod
+    def CacheInfo():
+        """Return the hit and miss counters of the in-memory caches of this process.
+
+        Returns
+        --------
+        info (dict):
+            {result store file name: {"hits": ..., "misses": ..., "size": ..., "maxsize": ...}}
+        """
+        return {os.path.basename(path): cache.Info() for path, cache in FileProcess.__caches.items()}
+
+    def ExportResults(self, filename=None):
+        """Write the saved results to a JSON file in the same format as the former result file.
+
+        Parameters
+        ----------
+        filename (string):
+            File name (defaults to RESULT_RESTORE_FILE)
+        """
+        if filename is None:
+            filename = self.RESULT_RESTORE_FILE
+        self.NewCreateFile(filename, list(self.store.Entries()))
 
     def NewCreateFile(self, filename, data=None):
         """Function for creating a new file.
@@ -188,23 +242,126 @@ class FileProcess:
             return solutions['value']
     
     
-    def ReceivingError(self, value, id):
-        """If an error occurs during reception, store the unreceived solution
+    @staticmethod
+    def FormatValues(values):
+        """Convert the argument of Run into a list of solutions.
 
         Parameters
         ----------
-            value (list):
-                Unreceived solution
-            id (list):
-                ID you should have received
+        values : list or numpy.ndarray
+            A solution or a list of solutions (a 1-D or 2-D array)
         """
-        trans_data = [{"id":i, "value" : v} for i,v in zip(id,value)]
-        output_data = {
-            str(self.RESULT_RESTORE_FILE): trans_data
-        }
+        # Convert an array in one step instead of element by element
+        if hasattr(values, 'tolist'):
+            values = values.tolist()
+        # Check if there are no lists in the list
+        contains_no_list = all(not isinstance(item, list) for item in values)
         
-        with open(self.UNRECEIVE_FILE, 'w') as f:
-            f.write(json.dumps(output_data, indent=4))
+        # What to do if the argument is not a double list
+        set_list = []
+        if contains_no_list:
+            set_list.append(values)
+        else:
+            set_list = values.copy()
+        return set_list
+
+    @staticmethod
+    def ResultArrays(results):
+        """Convert the return value of Run into arrays aligned with the solutions.
+
+        Parameters
+        ----------
+        results : list
+            List of {solution: {"objective": ..., "info": ...}}
+
+        Returns
+        --------
+        objective : numpy.ndarray
+            Evaluation values (shape (n,), or (n, m) for m objectives). Missing values are NaN.
+        info : numpy.ndarray
+            'info' of each evaluation value (dtype object)
+        """
+        if np is None:
+            raise ImportError("NumPy is required for array results (pip install numpy)")
+        items = [list(r.values())[0] if r else {} for r in results]
+        objectives = [item.get("objective") for item in items]
+        # Number of objectives (None for single-objective values)
+        width = next((len(o) for o in objectives if isinstance(o, (list, tuple))), None)
+        missing = np.nan if width is None else [np.nan] * width
+        objective = np.array([missing if o is None else o for o in objectives], dtype=float)
+        info = np.empty(len(items), dtype=object)
+        for n, item in enumerate(items):
+            info[n] = item.get("info")
+        return objective, info
+
+    def Evaluations(self, errors=False, top=None, since=None, until=None, info=True):
+        """Load the stored evaluations as contiguous arrays, e.g. to warm-start an optimizer.
+
+        The arrays are read from the columns of the result store (see ResultStore.Columns),
+        so only the selected rows are copied and no solution is parsed.
+
+        Parameters
+        ----------
+        errors (bool):
+            Also return solutions that were evaluated without a numeric value (NaN objectives)
+        top (int):
+            Only return this number of solutions with the smallest first objective, best first
+        since (float):
+            Only return evaluations stored at or after this time (seconds since the epoch)
+        until (float):
+            Only return evaluations stored before this time
+            (with since or until, evaluations whose time is not known are left out: those stored
+            before the columns existed and those imported from JSON result files)
+        info (bool):
+            Also return the 'info' of the evaluations (None is returned instead if False)
+
+        Returns
+        --------
+        x : numpy.ndarray
+            Solutions, shape (n, dimension)
+        objective : numpy.ndarray
+            Evaluation values (shape (n,), or (n, m) for m objectives)
+        info : numpy.ndarray
+            'info' of each evaluation value (dtype object)
+        """
+        if np is None:
+            raise ImportError("NumPy is required for Evaluations (pip install numpy)")
+        columns = self.store.Columns()
+        if columns is None:
+            raise ValueError("Evaluations requires the columns of the result store (store.columns)")
+        solutions, objectives, times = columns
+        if objectives is None:
+            # Nothing has been evaluated yet
+            objectives = np.full((len(times), 1), np.nan)
+        # Evaluations that have been received
+        mask = ~np.isnan(times)
+        if not errors:
+            mask &= np.isfinite(objectives).all(axis=1)
+        if since is not None or until is not None:
+            # The time of evaluations stored before the columns existed is not known (UNKNOWN_TIME)
+            mask &= np.isfinite(times)
+        if since is not None:
+            mask &= times >= since
+        if until is not None:
+            mask &= times < until
+        rows = np.flatnonzero(mask)
+        if top is not None:
+            first = objectives[rows, 0]
+            if top < len(rows):
+                # Select the best ones before sorting (NaN is placed last)
+                best = np.argpartition(first, top)[:top]
+                rows, first = rows[best], first[best]
+            rows = rows[np.argsort(first, kind='stable')]
+        x = np.ascontiguousarray(solutions[rows])
+        objective = np.ascontiguousarray(objectives[rows])
+        if objective.shape[1] == 1:
+            objective = objective.ravel()
+        if not info:
+            return x, objective, None
+        infos = np.empty(len(rows), dtype=object)
+        for n, i in enumerate(self.store.ColumnInfo(rows.tolist())):
+            infos[n] = i
+        return x, objective, infos
 
     def setValue(self, values, filename=None):
         """Function to write solutions to the JSON file used for sending.
@@ -224,18 +381,8 @@ class FileProcess:
         # Read JSON file
         with open(filename, 'r') as file:
             json_values = json.load(file)
-        
-        # Check if there are no lists in the list
-        contains_no_list = all(not isinstance(item, list) for item in values)
-        
-        # What to do if the argument is not a double list
-        set_list = []
-        if contains_no_list:
-            set_list.append(values)
-        else:
-            set_list = values.copy()
 
-        json_values['value'] = set_list
+        json_values['value'] = self.FormatValues(values)
 
         with open(filename, "w") as f:
             json.dump(json_values, f, indent=4)
@@ -1,72 +1,267 @@
 import json
 import os
+import sqlite3
 import subprocess
+try:
+    from .config import LoadConfig
+    from .ratelimit import RateLimiter
+except ImportError:
+    from config import LoadConfig
+    from ratelimit import RateLimiter
+
+# Seconds to wait for another process holding the database lock
+LOCK_TIMEOUT = 60
+# Number of solutions fetched from opt per request when syncing
+PAGE_SIZE = 100
+
+
+class HistoryStore:
+    """Local mirror of the solutions submitted to opt.
+
+    Solutions are stored under their opt id, so syncing the same solution again
+    only updates it. For each user and matchID the store remembers up to which id
+    the history is complete, so that a sync only fetches newer solutions.
+
+    Parameters
+    ----------
+    path: string
+        Path to the database file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        with self.__conn:
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                " id INTEGER PRIMARY KEY,"
+                " user_name TEXT NOT NULL,"
+                " match_id TEXT NOT NULL,"
+                " created_at TEXT,"
+                " variable TEXT,"
+                " objective TEXT,"
+                " info TEXT,"
+                " finished INTEGER NOT NULL)"
+            )
+            self.__conn.execute("CREATE INDEX IF NOT EXISTS history_match ON history (user_name, match_id, id)")
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS synced ("
+                " user_name TEXT NOT NULL,"
+                " match_id TEXT NOT NULL,"
+                " last_id INTEGER NOT NULL,"
+                " PRIMARY KEY (user_name, match_id))"
+            )
+
+    def LastId(self, user_name, match_id):
+        """Return the id up to which the history of the matchID is complete (0 if never synced).
+
+        Parameters
+        ----------
+        user_name (string):
+            Owner of the solutions
+        match_id (string):
+            matchID
+        """
+        row = self.__conn.execute(
+            "SELECT last_id FROM synced WHERE user_name = ? AND match_id = ?",
+            (user_name, str(match_id))
+        ).fetchone()
+        return 0 if row is None else row[0]
+
+    def Save(self, user_name, match_id, solutions):
+        """Store solutions received from `opt list solutions`.
+
+        Parameters
+        ----------
+        user_name (string):
+            Owner of the solutions
+        match_id (string):
+            matchID
+        solutions (list):
+            'solutions' of the output of opt
+        """
+        rows = [
+            (x['id'], user_name, str(match_id), x.get('created_at'), json.dumps(x.get('variable')),
+             json.dumps(x.get('objective')), json.dumps(x.get('info')), int(self.Finished(x)))
+            for x in solutions
+        ]
+        with self.__conn:
+            self.__conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def MarkSynced(self, user_name, match_id, newest_id):
+        """Record that every solution up to newest_id has been fetched.
+
+        Solutions that were still being evaluated are fetched again by the next sync.
+
+        Parameters
+        ----------
+        user_name (string):
+            Owner of the solutions
+        match_id (string):
+            matchID
+        newest_id (int):
+            Largest id fetched by the sync
+        """
+        row = self.__conn.execute(
+            "SELECT MIN(id) FROM history WHERE user_name = ? AND match_id = ? AND id > ? AND finished = 0",
+            (user_name, str(match_id), self.LastId(user_name, match_id))
+        ).fetchone()
+        last_id = newest_id if row[0] is None else row[0] - 1
+        with self.__conn:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO synced (user_name, match_id, last_id) VALUES (?, ?, ?)",
+                (user_name, str(match_id), max(last_id, self.LastId(user_name, match_id)))
+            )
+
+    def Solutions(self, user_name, match_id, limit=None):
+        """Iterate over the stored solutions of the matchID, newest first.
+
+        Parameters
+        ----------
+        user_name (string):
+            Owner of the solutions
+        match_id (string):
+            matchID
+        limit (int):
+            Maximum number of solutions (all if not given)
+
+        Yields
+        --------
+        solution (dict):
+            {"id", "created_at", "variable", "objective", "info"} of one solution
+        """
+        cursor = self.__conn.execute(
+            "SELECT id, created_at, variable, objective, info FROM history "
+            "WHERE user_name = ? AND match_id = ? ORDER BY id DESC LIMIT ?",
+            (user_name, str(match_id), -1 if limit is None else limit)
+        )
+        for solution_id, created_at, variable, objective, info in cursor:
+            yield {"id": solution_id, "created_at": created_at, "variable": json.loads(variable),
+                   "objective": json.loads(objective), "info": json.loads(info)}
+
+    def Close(self):
+        self.__conn.close()
+
+    @staticmethod
+    def Finished(solution):
+        """Return True if opt has finished evaluating the solution (the same check as receiving).
+
+        Parameters
+        ----------
+        solution (dict):
+            One solution of the output of opt
+        """
+        return any(solution.get(k) is not None for k in ("objective", "evaluation_error", "scoring_error"))
+
 
 class History:
     # Variable to store the file directory path
     FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
+
     # Path to the configuration file
     CONFIGFILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files/__config.json'))
 
     # Path to store history
     RESTORE_DIRC = os.path.normpath(os.path.join(FILE_DIRECTORY, './__results_files'))
 
+    # Local mirror of the history
+    HISTORY_STORE_FILE = os.path.normpath(os.path.join(RESTORE_DIRC, './history.db'))
+
     def __init__(self):
-        json_load = json.load(open(self.CONFIGFILE, 'r'))
+        json_load = LoadConfig(self.CONFIGFILE)
         self.user_name = json_load['main']['opt']['user_name']
         history_json = json_load['history']
         self.max_row = history_json['limit']
+        # Number of solutions fetched per request when syncing
+        self.page_size = history_json.get('page', PAGE_SIZE)
+        self.store = HistoryStore(self.HISTORY_STORE_FILE)
+        # Requests to opt share the limit of the polls of the runs
+        self.poll_limit = RateLimiter.FromConfig("opt", "poll", json_load.get('rate'))
 
 
     def GetHist(self, output_file=''):
         # Display using print
         # Enter matchID or job ID to display
-        history_data = []
-        
         print("Specify matchID")
         search_id = input()
-        send_stdout = subprocess.check_output(  # Run a command and get the output
-                args=f"opt list solutions --limit {self.max_row} --query \"_and: [{{match_id: {{_eq: {search_id}}}}}, {{owner: {{name: {{_eq: {self.user_name}}}}}}}]\"",
-                shell=True,
-                text=True
-            )
-        search_data = json.loads(send_stdout) 
-        print("-" * 45)
-        for x in search_data['solutions']:
-            print(f"{'date':<15} : {x['created_at']}")
-            print(f"{'objective':<15} : {x['objective']}")
-            print(f"{'variable':<15} : {x['variable']}")
-            print(f"{'info':<15} : {x['info']}")
-            print("-" * 45)
+        print(self.Report(search_id, output_file))
+
+    def Report(self, match_id, output_file=''):
+        """Sync the history of the matchID and return the latest solutions as text.
+
+        Parameters
+        ----------
+        match_id (string):
+            matchID
+        output_file (string):
+            Also export the whole history to <output_file>.jsonl if given
+        """
+        lines = []
+        try:
+            self.Sync(match_id)
+        except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+            # Answer from the local mirror when opt cannot be reached
+            lines.append(f"Unable to sync the history, showing the saved history. Error: {e}")
+        lines.append("-" * 45)
+        for x in self.store.Solutions(self.user_name, match_id, self.max_row):
+            lines.append(f"{'date':<15} : {x['created_at']}")
+            lines.append(f"{'objective':<15} : {x['objective']}")
+            lines.append(f"{'variable':<15} : {x['variable']}")
+            lines.append(f"{'info':<15} : {x['info']}")
+            lines.append("-" * 45)
         if output_file:
-            for x in search_data['solutions']:
-                history_data.append({str(x['variable']): {"objective": x['objective'], "date": x['created_at'], "info": x['info']}})
-            self.setjson(history_data, output_file)
-        # result = ["variable:" + str(x['variable']) + ", objective:" + str(x['objective']) for x in search_data['solutions']]
-        # print(result)
-        # self.setjson(history_data)
-
-
-
-    def setjson(self, setdata, filename):
-        filepath = os.path.normpath(os.path.join(self.RESTORE_DIRC, f'./{filename}.json'))
-        if not os.path.exists(filepath):
-            if setdata is None:
-                open(filepath, "w")
-            else:
-                with open(filepath, "w") as f:
-                    json.dump(setdata, f, indent=4)
-        else:
-            with open(filepath, 'r') as f:
-                now_data = json.load(f)
-                
-            # Add only data that does not exist in the existing data
-            for data in setdata:
-                key = list(data.keys())[0]
-                if key not in [list(d.keys())[0] for d in now_data]:
-                    now_data.append(data)
-                
-            # Write JSON data to the file
-            with open(filepath, 'w') as f:
-                json.dump(now_data, f, indent=4)
+            self.Export(match_id, output_file)
+        return "\n".join(lines)
+
+    def Sync(self, match_id):
+        """Fetch the solutions submitted since the last sync, one page at a time.
+
+        Pages are fetched from the newest solution down to the last synced id, and
+        each page is saved as soon as it is received.
+
+        Parameters
+        ----------
+        match_id (string):
+            matchID
+        """
+        last_id = self.store.LastId(self.user_name, match_id)
+        newest_id = None
+        upper = None
+        while True:
+            conditions = [f"{{match_id: {{_eq: {match_id}}}}}",
+                          f"{{owner: {{name: {{_eq: {self.user_name}}}}}}}",
+                          f"{{id: {{_gt: {last_id}}}}}"]
+            if upper is not None:
+                conditions.append(f"{{id: {{_lt: {upper}}}}}")
+            self.poll_limit.Acquire()
+            send_stdout = subprocess.check_output(  # Run a command and get the output
+                    args=f"opt list solutions --limit {self.page_size} --query \"_and: [{', '.join(conditions)}]\"",
+                    shell=True,
+                    text=True
+                )
+            page = json.loads(send_stdout)['solutions']
+            self.store.Save(self.user_name, match_id, page)
+            if page:
+                ids = [x['id'] for x in page]
+                newest_id = max(ids) if newest_id is None else max(newest_id, max(ids))
+                upper = min(ids)
+            if len(page) < self.page_size:
+                break
+        if newest_id is not None:
+            self.store.MarkSynced(self.user_name, match_id, newest_id)
+
+    def Export(self, match_id, filename):
+        """Write the saved history of the matchID to a JSON Lines file, one solution per line.
+
+        Solutions are written as they are read from the local mirror, without building the whole history in memory.
+
+        Parameters
+        ----------
+        match_id (string):
+            matchID
+        filename (string):
+            File name (saved as <filename>.jsonl in the results directory)
+        """
+        filepath = os.path.normpath(os.path.join(self.RESTORE_DIRC, f'./{filename}.jsonl'))
+        with open(filepath, 'w') as f:
+            for x in self.store.Solutions(self.user_name, match_id):
+                f.write(json.dumps({str(x['variable']): {"objective": x['objective'], "date": x['created_at'], "info": x['info']}}) + "\n")
@@ -0,0 +1,149 @@
+#!/usr/local/bin/python
+import os
+import glob
+import json
+import fcntl
+import threading
+
+# Variable to store the file directory path
+FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Directory of the journals of runs that have not received every evaluation value
+JOURNAL_DIRECTORY = os.path.normpath(os.path.join(FILE_DIRECTORY, './__error_files/__journal'))
+
+
+class SendJournal:
+    """Write-ahead journal of the solutions submitted by one run.
+
+    Each submitted solution is appended as soon as its submit command succeeds, and each
+    received evaluation value is marked as done, so that a run killed while sending or
+    receiving can be resumed without submitting anything again. The journal is removed
+    when every evaluation value has been received.
+
+    The file is locked while the run is alive, so only journals of runs that have ended
+    are returned by Pending.
+
+    Parameters
+    ----------
+    path: string
+        Path to the journal file (<recipient>.<run>.jsonl in JOURNAL_DIRECTORY).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.recipient, run = os.path.basename(path).rsplit('.', 2)[:2]
+        # Row of the run in the status database (None if the run had no row)
+        self.run = int(run) if run.isdigit() else None
+        self.__file = open(path, 'a+')
+        try:
+            fcntl.flock(self.__file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another process is still using the journal
+            self.__file.close()
+            raise
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def Create(cls, recipient, run):
+        """Create the journal of a new run.
+
+        Parameters
+        ----------
+        recipient (string):
+            Recipient of the run
+        run (int):
+            Row of the run in the status database
+        """
+        os.makedirs(JOURNAL_DIRECTORY, exist_ok=True)
+        if run is None:
+            run = f"p{os.getpid()}"
+        return cls(os.path.join(JOURNAL_DIRECTORY, f"{recipient}.{run}.jsonl"))
+
+    @classmethod
+    def Pending(cls, recipient=None):
+        """Return the journals of ended runs (locked until they are closed or removed), oldest first.
+
+        Parameters
+        ----------
+        recipient (string):
+            Only the journals of this recipient (all recipients if not given)
+        """
+        pattern = f"{glob.escape(recipient)}.*.jsonl" if recipient is not None else "*.jsonl"
+        journals = []
+        for path in sorted(glob.glob(os.path.join(JOURNAL_DIRECTORY, pattern)), key=SendJournal.__Order):
+            if recipient is not None and os.path.basename(path).rsplit('.', 2)[0] != recipient:
+                continue
+            try:
+                journals.append(cls(path))
+            except OSError:
+                # Still running, or removed in the meantime
+                continue
+        return journals
+
+    @classmethod
+    def Recipients(cls):
+        """Return the recipients that have journals of ended runs."""
+        recipients = set()
+        for journal in cls.Pending():
+            recipients.add(journal.recipient)
+            journal.Close()
+        return sorted(recipients)
+
+    def Sent(self, entry):
+        """Append a submitted solution (may be called from worker threads).
+
+        Parameters
+        ----------
+        entry (dict):
+            {"key": ID of the submission, "value": solution, ...} with what the recipient needs to receive it
+        """
+        self.__Write({"sent": entry})
+
+    def Done(self, key):
+        """Mark the evaluation value of a submission as received.
+
+        Parameters
+        ----------
+        key:
+            "key" of the entry
+        """
+        self.__Write({"done": key})
+
+    def Entries(self):
+        """Return the entries whose evaluation values have not been received, in the order they were sent."""
+        with self.__lock:
+            self.__file.seek(0)
+            lines = self.__file.readlines()
+        entries = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line cut off by the crash
+                continue
+            if "sent" in record:
+                entries[json.dumps(record["sent"]["key"])] = record["sent"]
+            elif "done" in record:
+                entries.pop(json.dumps(record["done"]), None)
+        return list(entries.values())
+
+    def Close(self):
+        """Release the journal and keep it for resuming."""
+        if not self.__file.closed:
+            self.__file.close()
+
+    def Remove(self):
+        """Delete the journal (every evaluation value has been received)."""
+        if not self.__file.closed:
+            os.remove(self.path)
+            self.__file.close()
+
+    @staticmethod
+    def __Order(path):
+        # Journals are ordered by the row of their run in the status database
+        run = os.path.basename(path).rsplit('.', 2)[1]
+        return (0, int(run), path) if run.isdigit() else (1, 0, path)
+
+    def __Write(self, record):
+        # Each record is one line, flushed so that it survives the process being killed
+        with self.__lock:
+            self.__file.write(json.dumps(record) + "\n")
+            self.__file.flush()
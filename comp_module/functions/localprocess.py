@@ -0,0 +1,202 @@
+#!/usr/local/bin/python
+from subprocess import run, CalledProcessError
+try:
+    from .status import StatusEnum
+    from .aio import CheckOutput
+    from .metrics import RunMetrics
+except ImportError:
+    from status import StatusEnum
+    from aio import CheckOutput
+    from metrics import RunMetrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import json
+import os
+
+class LocalProcess:
+    """Class for evaluating solutions with a command on the local machine.
+
+    Each solution is written to the standard input of the command as JSON, and the command
+    prints {"objective": ..., "info": ...} as JSON, in the same way as a qsub job.
+
+    Parameters
+    ----------
+    sm: StatusManager
+        Class for recording and checking statuses.
+    fp: FileProcess
+        Class for executing file-related processes.
+    cmd: string
+        Command that evaluates one solution.
+    workers: int
+        Number of evaluations run at the same time (defaults to the number of CPU cores).
+    """
+    def __init__(self, sm, fp, cmd, workers=None):
+        # Record status using sm
+        self.sm = sm
+        # Store the class for file processing
+        self.fp = fp
+        # Command that evaluates one solution
+        self.__cmd = cmd
+        # Number of evaluations run at the same time
+        self.__workers = max(1, int(workers or os.cpu_count() or 1))
+        # List to store sent solutions
+        self.__send_value_list = []
+
+        self.__result_list = []
+        self.__positions = []
+        # Running evaluations
+        self.__executor = None
+        self.__futures = []
+        self.__tasks = []
+        # Timings of this run
+        self.metrics = RunMetrics()
+
+    def SendProcess(self, send_data: list):
+        """Start evaluating the solutions in a pool of worker threads, each running the command as a subprocess.
+
+        Parameters
+        ----------
+        send_data(list): List of solutions to be evaluated.
+        """
+        send_data = self.__BeginSend(send_data)
+        if not send_data:
+            return
+        self.__executor = ThreadPoolExecutor(max_workers=self.__workers)
+        self.__futures = [self.__executor.submit(self.__Evaluate, data) for data in send_data]
+        self.metrics.Sent()
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
+
+    async def SendProcessAsync(self, send_data: list):
+        """Start evaluating the solutions with asyncio subprocesses.
+
+        Parameters
+        ----------
+        send_data(list): List of solutions to be evaluated.
+        """
+        send_data = self.__BeginSend(send_data)
+        if not send_data:
+            return
+        # Limit the number of evaluations run at the same time
+        semaphore = asyncio.Semaphore(self.__workers)
+
+        async def evaluate(k, data):
+            async with semaphore:
+                try:
+                    stdout = await CheckOutput(self.__cmd, input=json.dumps(data))
+                    return k, self.__Parse(stdout)
+                except (CalledProcessError, ValueError) as e:
+                    return k, e
+
+        self.__tasks = [asyncio.ensure_future(evaluate(k, data)) for k, data in enumerate(send_data)]
+        self.metrics.Sent()
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
+
+    def __BeginSend(self, send_data):
+        # Reset the lists and return the solutions that have not been evaluated before
+        self.__send_value_list.clear()
+        self.__result_list.clear()
+        self.__futures = []
+        self.__tasks = []
+
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENDING)
+        # Remove previously evaluated solutions
+        with self.metrics.Phase("dedup"):
+            send_data, self.__result_list = self.fp.CheckSolution(values=send_data)
+        if not send_data:
+            self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
+        self.__send_value_list = list(send_data)
+        # Positions of the solutions to be evaluated in the result list
+        self.__positions = [n for n, item in enumerate(self.__result_list) if item is None]
+        return send_data
+
+    def __Evaluate(self, data):
+        # Run the command for one solution and return its evaluation value
+        completed = run(self.__cmd, shell=True, input=json.dumps(data), capture_output=True, text=True, check=True)
+        return self.__Parse(completed.stdout)
+
+    @staticmethod
+    def __Parse(stdout):
+        # Read the {"objective": ..., "info": ...} printed by the command (ValueError for any other output)
+        outcome = json.loads(stdout)
+        if not isinstance(outcome, dict) or "objective" not in outcome or "info" not in outcome:
+            raise ValueError(f"The command did not print {{\"objective\": ..., \"info\": ...}}: {stdout.strip()[:200]}")
+        return outcome
+
+    def Resume(self, entries):
+        """Local evaluations end with the process, so there are no submissions to reattach to.
+
+        Parameters
+        ----------
+        entries (list):
+            Entries of the journals of the earlier runs (always empty, see SendJournal)
+        """
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
+
+    def GetProcess(self):
+        """Process for receiving evaluation values."""
+        for n, item in self.__Receive():
+            self.__result_list[n] = item
+        return self.__result_list
+
+    def GetIter(self):
+        """Yield each evaluation value as soon as it is computed.
+        Results of previously evaluated solutions are yielded first."""
+        for _, item in self.__Receive():
+            yield item
+
+    def __Receive(self):
+        # Yield (position in the result list, result) pairs as they become available
+        yield from self.__Cached()
+        if not self.__futures:
+            return
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING)
+        index = {future: k for k, future in enumerate(self.__futures)}
+        try:
+            for future in as_completed(self.__futures):
+                k = index[future]
+                try:
+                    outcome = future.result()
+                except (CalledProcessError, ValueError) as e:
+                    outcome = e
+                yield self.__Evaluated(k, outcome)
+        except (GeneratorExit, Exception):
+            # Stopped (or failed) before all evaluations finished
+            self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING_ERROR)
+            raise
+        finally:
+            self.__executor.shutdown(wait=False, cancel_futures=True)
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
+
+    async def ReceiveAsync(self):
+        """Yield (position, result) pairs as soon as they are computed, without blocking the event loop.
+        The position is the index of the solution in the list given to the sending process."""
+        for pair in self.__Cached():
+            yield pair
+        if not self.__tasks:
+            return
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING)
+        try:
+            for task in asyncio.as_completed(self.__tasks):
+                k, outcome = await task
+                yield self.__Evaluated(k, outcome)
+        except BaseException:
+            for task in self.__tasks:
+                task.cancel()
+            self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING_ERROR)
+            raise
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
+
+    def __Cached(self):
+        # Return the results that are known before evaluating
+        return [(n, item) for n, item in enumerate(self.__result_list) if item is not None]
+
+    def __Evaluated(self, k, outcome):
+        # Save the evaluation value of the k-th solution and return its (position, result) pair
+        self.metrics.Received()
+        position = self.__positions[k]
+        data = self.__send_value_list[k]
+        if isinstance(outcome, Exception):
+            # Failed evaluations are not saved, so that they are evaluated again next time
+            return position, {str(data): {"objective": None, "info": None, "error": f"{outcome.__class__.__name__}: {outcome}"}}
+        self.fp.SolutionRestore([data], [outcome['objective']], [outcome['info']])
+        return position, {str(data): {"objective": outcome["objective"], "info": outcome["info"]}}
@@ -1,17 +1,20 @@
 #!/usr/local/bin/python
 from subprocess import check_output, CalledProcessError
 import subprocess
-# from module.main import Process
+from .divide import Process
+from .scheduler import Scheduler
 from .history import History
 from .fileprocess import FileProcess
 from .status import StatusManager
+from .journal import SendJournal
+from .daemon import Daemon, DaemonClient
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import asyncio
 import os
 
-# Variable to store the file directory path
-FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-# File path where unsubmitted solutions are stored
-UNRECEIVE_FILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__error_files/UnReceiveData.json'))
+# Runs started by Submit (references are kept until they finish)
+RUNNING_TASKS = set()
 
 class Main():
     """
@@ -22,91 +25,307 @@ class Main():
         parser = argparse.ArgumentParser() 
         parser.add_argument('-s', '--status', action='store_true',default=False)
         parser.add_argument('-hi','--history',action='store_true',default=False)
+        parser.add_argument('-f', '--front', action='store_true', default=False)
+        parser.add_argument('-r', '--resume', action='store_true', default=False)
         parser.add_argument('-o', '--output',action='store',nargs='?',type=str,default='')
+        parser.add_argument('-d', '--daemon', action='store_true', default=False)
         self.args = parser.parse_args()
     
-    # 実装予定の再受信機能のための関数
     def __Check_Received(self):
-        """Check if the evaluation value of the submitted solution was received when executed previously
+        """Check if the evaluation values of the solutions submitted by previous runs were received
 
-        Parameters
-        ----------
-        check (boolean):
-            Returns True if received.
+        Returns
+        --------
+        recipients (list):
+            Recipients that have solutions whose evaluation values were not received
         """
-        check = None
-        # Check if you received it
-        if os.path.exists(UNRECEIVE_FILE):
-            if os.path.getsize(UNRECEIVE_FILE) != 0:
-                check = True
-            else:
-                check = False
-                os.remove(UNRECEIVE_FILE)
-        else:
-            check =False
-
-        return check
+        return SendJournal.Recipients()
     
     
+    def __AskResume(self, dir_file):
+        # Receive the solutions of ended runs in the background if the user agrees
+        recipients = self.__Check_Received()
+        if not recipients:
+            print("There are no solutions that have not been received.")
+            return
+        print("There are solutions that have not been received. Would you like to receive it again?")
+        while True:
+            user_input = input("Please answer Yes or No (y/n): ").lower()
+            if user_input in ["y", "yes"]:
+                # Stores the path of the executable file to run in the background (using subprocess)
+                run_path = os.path.normpath(os.path.join(dir_file,'./divide.py'))
+                for recipient in recipients:
+                    # execution command
+                    cmd = ['python3', run_path, '-re', '-t', recipient]
+                    # Do not get evaluation value
+                    process = subprocess.Popen(cmd,stdout=subprocess.DEVNULL)
+                break
+            elif user_input in ["n", "no"]:
+                break
+            else:
+                print("Invalid input. Please answer with 'y' or 'n'.")
+
+    @staticmethod
+    def __Daemon():
+        # Client of the running daemon, or None to do the work in this process
+        client = DaemonClient()
+        return client if client.Running() else None
+
+    @staticmethod
+    def __Values(value):
+        # Solutions given as the argument, or None to read them from the solution file
+        # (len is used instead of truth testing so that NumPy arrays are accepted)
+        if value is None or len(value) == 0:
+            return None
+        return value
+
+    @staticmethod
+    def __Payload(value):
+        # Solutions to send to the daemon as JSON (None: the daemon reads the solution file)
+        values = Main.__Values(value)
+        return None if values is None else FileProcess.FormatValues(values)
+
     def Run(self, value=None, no_wait=False):
         """
         Function that executes the module
         
         Parameters
         ----------
-        value (list):
+        value (list or numpy.ndarray):
             the solution you want to send
         available (boolean):
             Whether to receive an evaluation value as a return value. True if received
         """
         out = None
-        
-        if self.__Check_Received():
-            print("There are solutions that have not been received. Would you like to receive it again?")
-            while True:
-                user_input = input("Please answer Yes or No (y/n): ").lower()
-                if user_input in ["y", "yes"]:
-                    # Stores the path of the executable file to run in the background (using subprocess)
-                    run_path = os.path.normpath(os.path.join(dir_file,'./divide.py'))
-                    # execution command
-                    cmd = ['python3', run_path, '-re']
-                    # Do not get evaluation value
-                    process = subprocess.Popen(cmd,stdout=subprocess.DEVNULL)
-                elif user_input in ["n", "no"]:
-                    
-                    break
-                else:
-                    print("Invalid input. Please answer with 'y' or 'n'.")
-            
         dir_file = os.path.dirname(os.path.abspath(__file__))
+        
+        client = self.__Daemon()
         # Run solution submission in background (using subprocess) only if option is not selected
-        if(self.args.status) :
+        if(self.args.resume) :
+            # Ask before receiving the solutions of ended runs in the background
+            self.__AskResume(dir_file)
+        elif(self.args.daemon) :
+            # Serve Run, status and history requests of other processes until stopped
+            Daemon().Serve()
+        elif(self.args.status) :
             # Make sending/receiving information visible
-            StatusManager.Show()
+            if client is not None:
+                print(client.Call("status"))
+            else:
+                StatusManager.Show()
         elif(self.args.history) :
             # View history information
-            History().GetHist(self.args.output)
+            if client is not None:
+                print("Specify matchID")
+                search_id = input()
+                print(client.Call("history", match_id=search_id, output=self.args.output))
+            else:
+                History().GetHist(self.args.output)
+        elif(self.args.front) :
+            # View the Pareto front and the best results of a recipient
+            print("Specify target (opt_<matchID>, qsub_<name>, qsub_<name>_<model> or local)")
+            target = input()
+            if client is not None:
+                print(client.Call("front", target=target))
+            else:
+                print(FileProcess(resultID=target).ArchiveReport())
         else :
-            if value:
-                FileProcess().setValue(values=value)
-            # Stores the path of the executable file to run in the background (using subprocess)
-            run_path = os.path.normpath(os.path.join(dir_file,'./divide.py'))
-            # execution command
-            cmd = ['python3', run_path]
+            if self.__Check_Received():
+                # Library calls must not wait for input, so resuming is left to Resume (or -r)
+                print("There are solutions of ended runs that have not been received. Call Resume() or run with -r to receive them.")
             # Whether or not to obtain the evaluation value (set with the argument available)
-            if no_wait:
+            if no_wait and client is not None:
+                # The daemon runs it after answering, so that it is the only process writing the files
+                try:
+                    client.Call("run", values=self.__Payload(value), wait=False)
+                except (OSError, RuntimeError) as e:
+                    print(f"{e.__class__.__name__}: {e}")
+                out = None
+            elif no_wait:
+                if self.__Values(value) is not None:
+                    FileProcess().setValue(values=value)
+                # Stores the path of the executable file to run in the background (using subprocess)
+                run_path = os.path.normpath(os.path.join(dir_file,'./divide.py'))
+                # execution command
+                cmd = ['python3', run_path]
                 # Do not get evaluation value
                 process = subprocess.Popen(cmd,stdout=subprocess.DEVNULL)
                 out = None
                 
             else:
                 try:
-                    # Get evaluation value
-                    process = subprocess.Popen(cmd, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=False)
-                    out, err = process.communicate()
-                    out = eval(out)
-                except Exception as e:
+                    if client is not None:
+                        # Get evaluation value from the daemon
+                        out = client.Call("run", values=self.__Payload(value))
+                    else:
+                        # Get evaluation value (run in this process)
+                        out = Process(values=self.__Values(value), argv=[]).run()
+                except (Exception, SystemExit) as e:
                     print(f"{e.__class__.__name__}: {e}")
                     return None
             
-            return out
\ No newline at end of file
+            return out
+
+    def RunArray(self, population):
+        """
+        Function that executes the module for a population given as an array
+
+        Parameters
+        ----------
+        population (numpy.ndarray):
+            2-D array with one solution per row
+
+        Returns
+        --------
+        objective (numpy.ndarray):
+            Evaluation values aligned with the rows (NaN if not received)
+        info (numpy.ndarray):
+            'info' of each evaluation value
+        """
+        out = self.Run(population)
+        if out is None:
+            return None
+        return FileProcess.ResultArrays(out)
+
+    def CacheInfo(self):
+        """
+        Function that returns the hit and miss counters of the in-memory result caches
+
+        Returns
+        --------
+        info (dict):
+            {result store file name: {"hits": ..., "misses": ..., "size": ..., "maxsize": ...}}
+        """
+        return FileProcess.CacheInfo()
+
+    def Resume(self):
+        """
+        Function that receives the evaluation values of solutions submitted by runs that ended before receiving them
+        (killed while sending or receiving). Nothing is submitted again.
+
+        Returns
+        --------
+        results (dict):
+            {recipient: list of {solution: {"objective": ..., "info": ...}}} for each resumed recipient
+        """
+        client = self.__Daemon()
+        if client is not None:
+            # The daemon receives them, so that it is the only process writing the files
+            return client.Call("resume")
+        results = {}
+        for recipient in self.__Check_Received():
+            try:
+                results[recipient] = Process(argv=['-re'], target=recipient).run()
+            except (Exception, SystemExit) as e:
+                print(f"{e.__class__.__name__}: {e}")
+                results[recipient] = None
+        return results
+
+    def RunIter(self, value=None):
+        """
+        Function that executes the module and yields each evaluation value as soon as it is received
+
+        Parameters
+        ----------
+        value (list):
+            the solution you want to send
+
+        Yields
+        --------
+        result (dict):
+            {solution: {"objective": ..., "info": ...}} of one solution.
+            Results of previously sent solutions are yielded first.
+            If the iteration is stopped early, the solutions not yet received can be received by Resume.
+        """
+        client = self.__Daemon()
+        try:
+            if client is not None:
+                # Each evaluation value is passed on by the daemon as soon as it receives it
+                yield from client.Iter(values=self.__Payload(value))
+            else:
+                yield from Process(values=self.__Values(value), argv=[]).runIter()
+        except (Exception, SystemExit) as e:
+            print(f"{e.__class__.__name__}: {e}")
+
+    async def Submit(self, value=None):
+        """
+        Function that sends solutions from an asyncio event loop
+
+        Parameters
+        ----------
+        value (list):
+            the solution you want to send
+
+        Returns
+        --------
+        futures (list):
+            asyncio.Future for each solution, resolved with {solution: {"objective": ..., "info": ...}}
+            as soon as its evaluation value is received (when the run finishes if a daemon is running).
+        """
+        loop = asyncio.get_running_loop()
+        client = self.__Daemon()
+        if client is not None:
+            return self.__SubmitToDaemon(client, loop, value)
+        process = Process(values=self.__Values(value), argv=[])
+        futures = [loop.create_future() for _ in process.sendList]
+        task = loop.create_task(process.runAsync(futures))
+        RUNNING_TASKS.add(task)
+        task.add_done_callback(RUNNING_TASKS.discard)
+        return futures
+
+    def __SubmitToDaemon(self, client, loop, value):
+        # Run the batch in the daemon and resolve the futures with its result
+        values = self.__Payload(value)
+        if values is None:
+            values = FileProcess.FormatValues(FileProcess().send_data)
+        futures = [loop.create_future() for _ in values]
+
+        async def relay():
+            try:
+                results = await asyncio.to_thread(client.Call, "run", values=values)
+                if results is None:
+                    raise RuntimeError("The run in the daemon ended without evaluation values")
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for future, item in zip(futures, results):
+                if not future.done():
+                    future.set_result(item)
+
+        task = loop.create_task(relay())
+        RUNNING_TASKS.add(task)
+        task.add_done_callback(RUNNING_TASKS.discard)
+        return futures
+
+    def Schedule(self, batches, workers=None, per_target=None):
+        """
+        Function that sends batches of solutions to several recipients at the same time
+
+        Parameters
+        ----------
+        batches (list):
+            List of (target, solutions) pairs. target is "opt_<matchID>", "qsub_<name>",
+            "qsub_<name>_<model>" or "local" (None for the recipient in the configuration file).
+        workers (int):
+            Maximum number of batches running at the same time (scheduler.workers if not given)
+        per_target (int):
+            Maximum number of batches running at the same time for one target (scheduler.per_target if not given)
+
+        Returns
+        --------
+        results (list):
+            Evaluation values of each batch, in the same order as batches
+        """
+        client = self.__Daemon()
+        if client is not None:
+            # The batches are queued in the scheduler of the daemon (its limits apply)
+            with ThreadPoolExecutor(max_workers=max(1, len(batches))) as executor:
+                futures = [
+                    executor.submit(client.Call, "run", values=self.__Payload(solutions), target=target)
+                    for target, solutions in batches
+                ]
+                return [future.result() for future in futures]
+        with Scheduler(workers, per_target) as scheduler:
+            return scheduler.Map(batches)
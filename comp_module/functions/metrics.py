@@ -0,0 +1,110 @@
+#!/usr/local/bin/python
+from contextlib import contextmanager
+import threading
+import time
+
+# Percentiles shown by the status option
+PERCENTILES = [50, 90, 99]
+
+
+class RunMetrics:
+    """Timings of one run, recorded by the sending and receiving processes.
+
+    Phases are measured in seconds: "wait" (waiting for the previous run), "dedup"
+    (checking for previously sent solutions) and "submit" (sending the solutions).
+    Each submit command and each received evaluation value are also timed, the latter
+    from the end of sending, so that the time to the first and last result is known.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Seconds spent in each phase
+        self.phases = {}
+        # Number of checks for evaluation values
+        self.polls = 0
+        # Seconds taken by each submit command
+        self.submit_latency = []
+        # Seconds from the end of sending to the receipt of each evaluation value
+        self.result_latency = []
+        # Time when sending finished
+        self.sent = None
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def Phase(self, name):
+        """Add the time spent in the with block to the phase.
+
+        Parameters
+        ----------
+        name (string):
+            Name of the phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def Submitted(self, seconds):
+        """Record the time taken by one submit command (may be called from worker threads).
+
+        Parameters
+        ----------
+        seconds (float):
+            Time taken by the command
+        """
+        with self.__lock:
+            self.submit_latency.append(seconds)
+
+    def Sent(self):
+        """Record that sending has finished."""
+        self.sent = time.perf_counter()
+
+    def Received(self, count=1):
+        """Record the receipt of evaluation values.
+
+        Parameters
+        ----------
+        count (int):
+            Number of evaluation values received at this time
+        """
+        if self.sent is None:
+            return
+        latency = time.perf_counter() - self.sent
+        with self.__lock:
+            self.result_latency.extend([latency] * count)
+
+    def Poll(self):
+        """Record one check for evaluation values."""
+        self.polls += 1
+
+    def Summary(self):
+        """Return the timings of the run as a dict (the row saved to the metrics log)."""
+        return {
+            "wait": self.phases.get("wait"),
+            "dedup": self.phases.get("dedup"),
+            "submit": self.phases.get("submit"),
+            "first_result": min(self.result_latency) if self.result_latency else None,
+            "last_result": max(self.result_latency) if self.result_latency else None,
+            "total": time.perf_counter() - self.start,
+            "polls": self.polls,
+            "solutions": len(self.result_latency),
+            "submit_latency": list(self.submit_latency),
+            "result_latency": list(self.result_latency),
+        }
+
+
+def Percentile(values, percent):
+    """Return the percentile of the values (nearest rank), or None if there are no values.
+
+    Parameters
+    ----------
+    values (list):
+        Values
+    percent (float):
+        Percentile between 0 and 100
+    """
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(min(rank, len(values))) - 1]
@@ -0,0 +1,151 @@
+#!/usr/local/bin/python
+from numbers import Real
+
+
+class NearIndex:
+    """KD-tree over solution vectors for finding solutions within a tolerance.
+
+    Two solutions match when every continuous dimension differs by at most its tolerance
+    and every other dimension is equal. Integers, strings, booleans and dimensions whose
+    tolerance is 0 are matched exactly; solutions with exactly matched dimensions are kept
+    in a separate tree for each combination of those values.
+
+    Parameters
+    ----------
+    tolerance: float or list
+        Tolerance for all dimensions, or a list with the tolerance of each dimension.
+    """
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        # Trees for each combination of exactly matched values
+        self.__groups = {}
+
+    def Add(self, solution, item=None):
+        """Add a solution to the index.
+
+        Parameters
+        ----------
+        solution (list):
+            Solution to add
+        item:
+            Value returned by Find for this solution (defaults to the solution)
+        """
+        split = self.__Split(solution)
+        if split is None:
+            return
+        signature, point, tolerance = split
+        group = self.__groups.get(signature)
+        if group is None:
+            group = self.__groups[signature] = _Tree(tolerance)
+        group.Add(point, solution if item is None else item)
+
+    def Find(self, solution):
+        """Return the item of the nearest stored solution within the tolerance, or None.
+
+        Parameters
+        ----------
+        solution (list):
+            Solution to look up
+        """
+        split = self.__Split(solution)
+        if split is None:
+            return None
+        signature, point, _ = split
+        group = self.__groups.get(signature)
+        if group is None:
+            return None
+        return group.Find(point)
+
+    def __len__(self):
+        return sum(len(group) for group in self.__groups.values())
+
+    def __Split(self, solution):
+        # Return (exactly matched values, continuous values, their tolerances), or None for other solutions
+        if not isinstance(solution, (list, tuple)):
+            return None
+        if isinstance(self.tolerance, (list, tuple)):
+            if len(self.tolerance) != len(solution):
+                return None
+            tolerances = self.tolerance
+        else:
+            tolerances = [self.tolerance] * len(solution)
+        signature, point, tolerance = [], [], []
+        for value, t in zip(solution, tolerances):
+            if isinstance(value, (list, tuple, dict)):
+                return None
+            if isinstance(value, float) and t:
+                # Continuous dimension: its position is marked in the signature
+                signature.append(None)
+                point.append(value)
+                tolerance.append(float(t))
+            elif isinstance(value, Real) and not isinstance(value, bool):
+                signature.append(float(value))
+            else:
+                signature.append(value)
+        return tuple(signature), point, tolerance
+
+
+class _Tree:
+    # KD-trees of the solutions sharing the same exactly matched values.
+    # Points are kept in balanced trees whose sizes are distinct powers of two; adding a point
+    # merges the trees of the same size like a binary counter, so the trees never degenerate
+    # even when solutions arrive in sorted order.
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.points = []
+        self.items = []
+        # (indices of the points, root node), largest first; node: (index, axis, left, right)
+        self.forest = []
+
+    def __len__(self):
+        return len(self.points)
+
+    def Add(self, point, item):
+        self.points.append(point)
+        self.items.append(item)
+        if not self.tolerance:
+            return
+        indices = [len(self.points) - 1]
+        while self.forest and len(self.forest[-1][0]) <= len(indices):
+            indices = self.forest.pop()[0] + indices
+        self.forest.append((indices, self.__Build(list(indices), 0)))
+
+    def Find(self, point):
+        if not self.tolerance:
+            # Only exactly matched dimensions: every solution in the group matches
+            return self.items[0] if self.items else None
+        best, best_distance = None, None
+        for n in self.__Candidates(point):
+            distance = self.__Distance(point, self.points[n])
+            if distance <= 1 and (best_distance is None or distance < best_distance):
+                best, best_distance = n, distance
+        return None if best is None else self.items[best]
+
+    def __Candidates(self, point):
+        # Points whose subtree may contain a point within the tolerance
+        stack = [root for _, root in self.forest]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            n, axis, left, right = node
+            yield n
+            if point[axis] - self.tolerance[axis] <= self.points[n][axis]:
+                stack.append(left)
+            if point[axis] + self.tolerance[axis] >= self.points[n][axis]:
+                stack.append(right)
+
+    def __Distance(self, a, b):
+        # Largest difference relative to the tolerance (a match is at most 1)
+        return max(abs(x - y) / t for x, y, t in zip(a, b, self.tolerance))
+
+    def __Build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % len(self.tolerance)
+        indices.sort(key=lambda n: self.points[n][axis])
+        middle = len(indices) // 2
+        return (indices[middle], axis,
+                self.__Build(indices[:middle], depth + 1),
+                self.__Build(indices[middle + 1:], depth + 1))
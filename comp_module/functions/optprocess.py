@@ -1,11 +1,30 @@
 #!/usr/local/bin/python
 from subprocess import check_output, CalledProcessError
-from status import StatusEnum
+try:
+    from .status import StatusEnum
+    from .polling import PollingPolicy
+    from .aio import CheckOutput
+    from .metrics import RunMetrics
+    from .journal import SendJournal
+    from .ratelimit import RateLimiter
+except ImportError:
+    from status import StatusEnum
+    from polling import PollingPolicy
+    from aio import CheckOutput
+    from metrics import RunMetrics
+    from journal import SendJournal
+    from ratelimit import RateLimiter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import time
 import json
 import string
+import re
 
-SLEEP_TIME = 60
+# Default number of solutions submitted concurrently
+SEND_WORKERS = 8
+# Default number of IDs asked for by one get command
+GET_PAGE_SIZE = 100
 
 class OptProcess:
     """
@@ -23,23 +42,50 @@ class OptProcess:
         Registered username.
     script: string
         Command script for executing send and receive operations on the OPT server.
-    send_id_list:
-        List of sent solution IDs used when re-receiving
-    send_value_list:
-        List of sent solutions used when re-receiving
+    workers: int
+        Number of solutions submitted concurrently.
+    polling: dict
+        Settings of the polling interval (see PollingPolicy).
+    page: int
+        Number of IDs asked for by one get command.
+    rate: dict
+        "rate" settings of the configuration file (see RateLimiter).
     """
-    def __init__(self, sm, fp, id, username, script, send_id_list=None, send_value_list = None):
+    def __init__(self, sm, fp, id, username, script, workers=SEND_WORKERS, polling=None, page=GET_PAGE_SIZE, rate=None):
         # Record status using sm
         self.sm = sm
         # Use this variable for file processing
         self.fp = fp
 
         # Lists to store IDs of sent solutions and received evaluation values
-        self.__send_id_list = send_id_list if send_id_list else []
+        self.__send_id_list = []
         self.__res_id_list = []
 
         # Variable to store sent solutions
-        self.__send_value_list = send_value_list if send_id_list else []
+        self.__send_value_list = []
+        # Variable to store the submission error of each solution (None if submitted)
+        self.__send_error_list = []
+        # Number of solutions submitted concurrently
+        self.__workers = max(1, int(workers))
+        # Settings of the polling interval
+        self.__polling = polling
+        # Number of IDs asked for by one get command
+        self.__page = max(1, int(page))
+        # Limits of the submit and get commands, shared with other processes
+        self.__submit_limit = RateLimiter.FromConfig("opt", "submit", rate)
+        self.__poll_limit = RateLimiter.FromConfig("opt", "poll", rate)
+        # Time when the solutions were sent (unknown when re-receiving)
+        self.__sent_time = None
+        # State of the receiving process
+        self.__position = {}
+        self.__value = {}
+        self.__pending = set()
+        self.__received_time = {}
+        self.__policy = None
+        # Timings of this run
+        self.metrics = RunMetrics()
+        # Journal of the submitted solutions (removed when every evaluation value is received)
+        self.__journal = None
         
         # Variable to store received
         self.__result_list = []
@@ -50,124 +96,327 @@ class OptProcess:
             "send": send,
             "get": get
         }
+        # Whether the get command asks for the sent IDs (${IDS}) rather than the newest solutions
+        self.__by_id = re.search(r"\$\{IDS\}|\$IDS\b", get) is not None
 
     def SendProcess(self, data: list):
         """
         Sending process: Use the opt command to send data.
+        Solutions are submitted concurrently by a pool of workers.
 
         Parameters
         ----------
         data (list): List of solutions.
         """
-        self.__send_id_list.clear()
-        self.__send_value_list.clear()
-        self.__result_list.clear()
+        check_data = None
         try:
-            self.sm.SetStatus(StatusEnum.SOLUTION_SENDING)
-            # Remove previously sent solutions
-            check_data, self.__result_list = self.fp.CheckSolution(values=data)
-            if not check_data:
-                self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
-                
-            else:
-                for i in check_data:
-                    send_stdout = check_output(
-                        args=string.Template(self.__script["send"]).safe_substitute({"SOLUTION": i}),
-                        shell=True,
-                        text=True
-                    )
-                    send_data = json.loads(send_stdout)
-                    self.__send_id_list.append(send_data['insert_solutions_one']['id'])
-                    self.__send_value_list.append(i)
-                
-                self.fp.SolutionRestore(self.__send_value_list)
-                self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
+            check_data = self.__BeginSend(data)
+            if check_data:
+                # Submit concurrently, but collect the results in the original order
+                outcomes = []
+                with self.metrics.Phase("submit"), ThreadPoolExecutor(max_workers=self.__workers) as executor:
+                    futures = [executor.submit(self.__Submit, i) for i in check_data]
+                    for future in futures:
+                        try:
+                            outcomes.append(future.result())
+                        except Exception as e:
+                            outcomes.append(e)
+                if not self.__EndSend(check_data, outcomes):
+                    exit()
         except Exception as e:
             print(check_data)
             if not check_data:
                 self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
                 exit()
             else:
+                # Keep the journal of the solutions submitted so far for re-receiving
+                if self.__journal is not None:
+                    self.__journal.Close()
                 self.sm.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
                 exit()
 
+    async def SendProcessAsync(self, data: list):
+        """
+        Sending process for asyncio: same as SendProcess, but the opt commands run as asyncio subprocesses.
+        Raises RuntimeError instead of exiting when no solution could be sent or taken from the saved results.
+
+        Parameters
+        ----------
+        data (list): List of solutions.
+        """
+        check_data = self.__BeginSend(data)
+        if not check_data:
+            return
+        # Limit the number of concurrent submissions
+        semaphore = asyncio.Semaphore(self.__workers)
+
+        async def submit(solution):
+            async with semaphore:
+                return await self.__SubmitAsync(solution)
+
+        with self.metrics.Phase("submit"):
+            outcomes = await asyncio.gather(*[submit(i) for i in check_data], return_exceptions=True)
+        if not self.__EndSend(check_data, outcomes):
+            raise RuntimeError("Every solution failed to be sent")
+
+    def __BeginSend(self, data):
+        # Reset the lists and return the solutions that have not been sent before
+        self.__send_id_list.clear()
+        self.__send_value_list.clear()
+        self.__send_error_list.clear()
+        self.__result_list.clear()
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENDING)
+        # Remove previously sent solutions
+        with self.metrics.Phase("dedup"):
+            check_data, self.__result_list = self.fp.CheckSolution(values=data)
+        if not check_data:
+            self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
+        else:
+            self.__journal = SendJournal.Create(self.sm.recipient, self.sm.number)
+        return check_data
+
+    def __EndSend(self, check_data, outcomes):
+        # Record the ID (or the exception) of each submission;
+        # return False if no solution was sent or taken from the saved results
+        resolved = any(item is not None for item in self.__result_list)
+        for i, outcome in zip(check_data, outcomes):
+            if isinstance(outcome, BaseException):
+                self.__send_error_list.append(f"{outcome.__class__.__name__}: {outcome}")
+            else:
+                self.__send_id_list.append(outcome)
+                self.__send_value_list.append(i)
+                self.__send_error_list.append(None)
+
+        # Solutions that failed to be sent are returned with their error
+        sent = zip(check_data, self.__send_error_list)
+        for n, item in enumerate(self.__result_list):
+            if item is None:
+                value, error = next(sent)
+                if error is not None:
+                    self.__result_list[n] = {str(value): {"objective": None, "info": None, "error": error}}
+
+        if not self.__send_id_list:
+            # Every submission failed; the saved results are still returned with the errors
+            self.__journal.Remove()
+            self.sm.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
+            return resolved
+        self.fp.SolutionRestore(self.__send_value_list)
+        self.__sent_time = time.time()
+        self.metrics.Sent()
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
+        return True
+
+    def __SendCommand(self, solution):
+        return string.Template(self.__script["send"]).safe_substitute({"SOLUTION": solution})
+
+    def __GetCommands(self):
+        # Get commands for the solutions still being evaluated, one per page of IDs
+        if not self.__by_id:
+            # Scripts without ${IDS} list the newest solutions of the matchID
+            return [string.Template(self.__script["get"]).safe_substitute({"SENDLISTSIZE": len(self.__send_id_list)})]
+        pending = [i for i in self.__send_id_list if i in self.__pending]
+        pages = [pending[n:n + self.__page] for n in range(0, len(pending), self.__page)]
+        return [
+            string.Template(self.__script["get"]).safe_substitute({
+                "SENDLISTSIZE": len(page),
+                "IDS": ", ".join(str(i) for i in page)
+            })
+            for page in pages
+        ]
+
+    def __Submit(self, solution):
+        # Submit one solution and return the ID assigned by the server
+        self.__submit_limit.Acquire()
+        start = time.perf_counter()
+        send_stdout = check_output(
+            args=self.__SendCommand(solution),
+            shell=True,
+            text=True
+        )
+        self.metrics.Submitted(time.perf_counter() - start)
+        return self.__Journal(solution, send_stdout)
+
+    async def __SubmitAsync(self, solution):
+        # Submit one solution and return the ID assigned by the server
+        await self.__submit_limit.AcquireAsync()
+        start = time.perf_counter()
+        send_stdout = await CheckOutput(self.__SendCommand(solution))
+        self.metrics.Submitted(time.perf_counter() - start)
+        return self.__Journal(solution, send_stdout)
+
+    def __Journal(self, solution, send_stdout):
+        # Record the submission in the journal right away and return the ID assigned by the server
+        send_data = json.loads(send_stdout)
+        solution_id = send_data['insert_solutions_one']['id']
+        self.__journal.Sent({"key": solution_id, "value": solution})
+        return solution_id
+
+    def Resume(self, entries):
+        """
+        Reattach to solutions submitted by earlier runs, so that only their evaluation values are received.
+
+        Parameters
+        ----------
+        entries (list):
+            Entries of the journals of the earlier runs (see SendJournal)
+        """
+        self.__send_id_list = [e['key'] for e in entries]
+        self.__send_value_list = [e['value'] for e in entries]
+        self.__result_list = [None for _ in entries]
+        if not entries:
+            self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
+            return
+        # Carry the entries over to the journal of this run
+        self.__journal = SendJournal.Create(self.sm.recipient, self.sm.number)
+        for e in entries:
+            self.__journal.Sent(e)
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
+
     def GetProcess(self):
         """
         Retrieval process: Return results when all solutions are finished.
         Return None if retrieval of solutions fails.
         """
+        for n, item in self.__Receive():
+            self.__result_list[n] = item
+        return self.__result_list
+
+    def GetIter(self):
+        """
+        Retrieval process: Yield each result as soon as it is received.
+        Results of previously sent solutions are yielded first.
+        """
+        for _, item in self.__Receive():
+            yield item
+
+    def __Receive(self):
+        # Yield (position in the result list, result) pairs as they become available
+        yield from self.__Cached()
+        if not self.__BeginReceive():
+            return
+        delays = self.__policy.Delays()
+        try:
+            while self.__pending:
+                # Wait until the next check
+                time.sleep(next(delays))
+                self.metrics.Poll()
+                for command in self.__GetCommands():
+                    self.__poll_limit.Acquire()
+                    try:
+                        stdout = check_output(
+                            args=command,
+                            shell=True,
+                            text=True
+                        )
+                    except CalledProcessError:
+                        self.__Unreceived()
+                        exit()
+                    yield from self.__Received(stdout)
+        except GeneratorExit:
+            # Stopped before all evaluation values were received
+            self.__Unreceived()
+            raise
+        self.__EndReceive()
+
+    async def ReceiveAsync(self):
+        """
+        Retrieval process for asyncio: yield (position, result) pairs as soon as they are received.
+        The position is the index of the solution in the list given to the sending process.
+        """
+        for pair in self.__Cached():
+            yield pair
+        if not self.__BeginReceive():
+            return
+        delays = self.__policy.Delays()
+        try:
+            while self.__pending:
+                # Wait until the next check without blocking the event loop
+                await asyncio.sleep(next(delays))
+                self.metrics.Poll()
+                for command in self.__GetCommands():
+                    await self.__poll_limit.AcquireAsync()
+                    try:
+                        stdout = await CheckOutput(command)
+                    except CalledProcessError:
+                        self.__Unreceived()
+                        raise
+                    for pair in self.__Received(stdout):
+                        yield pair
+        except (GeneratorExit, asyncio.CancelledError):
+            # Stopped before all evaluation values were received
+            self.__Unreceived()
+            raise
+        self.__EndReceive()
+
+    def __Cached(self):
+        # Return the results that are known before receiving
+        return [(n, item) for n, item in enumerate(self.__result_list) if item is not None]
+
+    def __BeginReceive(self):
+        # Prepare for receiving; return False if there is nothing to receive
         if not self.__send_value_list:
-            return self.__result_list
+            return False
         
         if not self.__send_id_list:
-            return self.__result_list
+            return False
         
+        # Positions of the sent solutions in the result list
+        positions = [n for n, item in enumerate(self.__result_list) if item is None]
+        self.__position = dict(zip(self.__send_id_list, positions))
+        self.__value = dict(zip(self.__send_id_list, self.__send_value_list))
+        # IDs whose evaluation values have not been received yet
+        self.__pending = set(self.__send_id_list)
+        # Time when each evaluation value was first seen
+        self.__received_time = {}
+
         self.__res_id_list.clear()
         # Receive
         self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING)
-        while True:
-            # Wait for 1 minute
-            time.sleep(SLEEP_TIME)
-            if not self.__send_id_list:
-                self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
-                exit()
-            try:
-                stdout = check_output(
-                    args=string.Template(self.__script["get"]).safe_substitute({"SENDLISTSIZE": len(self.__send_id_list)}),
-                    shell=True,
-                    text=True
-                )
-            except CalledProcessError:
-                if not self.__send_id_list:
-                    self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
-                    exit()
-                else:
-                    self.fp.ReceivingError(value=self.__send_value_list,id=self.__send_id_list)
-                    self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING_ERROR)
-                    exit()
+        self.__policy = PollingPolicy(self.__polling, self.fp.store)
+        return True
 
-            res = json.loads(stdout)
-            # Check for errors and other problems
-            err_flag = self.__Opt_check(res)
+    def __Received(self, stdout):
+        # Return (position, result) pairs of the solutions newly received in the output of the get command
+        res = json.loads(stdout)
+        now = time.time()
+        received = []
+        # Check for errors and other problems
+        for x in self.__Opt_check(res):
+            if x['id'] not in self.__pending:
+                continue
+            self.__pending.discard(x['id'])
+            self.__received_time[x['id']] = now
+            self.metrics.Received()
+            self.__journal.Done(x['id'])
+            # Save each evaluation value as soon as it is received
+            self.fp.SolutionRestore([self.__value[x['id']]], [x['objective']], info=[x['info']])
+            received.append((self.__position[x['id']], {str(x["variable"]): {"objective": x["objective"], "info": x["info"]}}))
+        return received
 
-            if not err_flag:
-                res['solutions'] = sorted(res['solutions'], key=lambda x: x['id'])
-                break
-        
-        
-        # Return objectives
-        values = [x['objective'] for x in res['solutions']]
-        info = [x['info'] for x in res['solutions']]
-        self.fp.SolutionRestore(self.__send_value_list,values,info=info)
+    def __EndReceive(self):
+        if self.__sent_time is not None:
+            # Learn how long evaluations take for the next run
+            self.__policy.Observe([t - self.__sent_time for t in self.__received_time.values()])
+        self.__journal.Remove()
         self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
-        # return values
-        # Extract objective and info values
-        extracted_data = [{str(solution["variable"]):{"objective": solution["objective"], "info": solution["info"]}} for solution in res["solutions"]]
-        for i, item in enumerate(self.__result_list):
-            if item == None:
-                self.__result_list[i] = extracted_data.pop(0)
-        return self.__result_list
+
+    def __Unreceived(self):
+        # Keep the journal so that the solutions that have not been received can be received again (-re)
+        self.__journal.Close()
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING_ERROR)
 
     def __Opt_check(self, res):
         # If any of the elements "objective", "evaluation_error", and "scoring_error" of the received element is not null,
         # It is assumed that the reception has been completed and is stored in the "id" value list.
-        res_id_list = []
+        received = []
         for x in res['solutions']:
             has_valid_objective = x["objective"] is not None
             has_valid_evaluation_error = x['evaluation_error'] is not None
             has_valid_scoring_error = x['scoring_error'] is not None
 
             if has_valid_objective or has_valid_evaluation_error or has_valid_scoring_error:
-                res_id_list.append(x['id'])
+                received.append(x)
         
         # List received IDs
-        self.__res_id_list = res_id_list
-        
-        if len(self.__res_id_list) < len(self.__send_id_list):
-            return True
-
-        # Compare sent IDs with received IDs to ensure correctness
-        if set(self.__res_id_list) == set(self.__send_id_list):
-            return False
-        else:
-            return True
+        self.__res_id_list = [x['id'] for x in received]
+        return received
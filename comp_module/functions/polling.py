@@ -0,0 +1,84 @@
+#!/usr/local/bin/python
+import random
+
+# Default settings of the polling interval (seconds)
+DEFAULT_POLLING = {
+    # Interval before the first check when no latency has been observed yet
+    "first": 5,
+    # Factor by which the interval grows after each unsuccessful check
+    "factor": 2.0,
+    # Upper limit of the interval
+    "max": 60,
+    # Relative random variation applied to each interval
+    "jitter": 0.1,
+    # Weight of the newest observation in the latency estimate
+    "smoothing": 0.3
+}
+
+
+class PollingPolicy:
+    """Decides how long to wait before each check for evaluation values.
+
+    The first check is scheduled at the evaluation latency observed so far for
+    the recipient; after that the interval grows exponentially up to a cap.
+
+    Parameters
+    ----------
+    config: dict
+        "polling" settings of the configuration file (DEFAULT_POLLING is used for missing keys).
+    store: ResultStore
+        Store of the recipient, used to keep the latency estimate between runs (optional).
+    """
+    # Name under which the latency estimate is kept in the store
+    LATENCY_KEY = "latency"
+
+    def __init__(self, config=None, store=None):
+        settings = dict(DEFAULT_POLLING)
+        if config:
+            settings.update(config)
+        self.first = float(settings["first"])
+        self.factor = max(1.0, float(settings["factor"]))
+        self.max = max(self.first, float(settings["max"]))
+        self.jitter = float(settings["jitter"])
+        self.smoothing = float(settings["smoothing"])
+
+        self.store = store
+        latency = store.GetMeta(self.LATENCY_KEY) if store is not None else None
+        self.latency = float(latency) if latency is not None else None
+        # Number of checks performed so far
+        self.polls = 0
+
+    def Delays(self):
+        """Generate the waiting time before each check."""
+        if self.latency is not None:
+            # Check first around the time the evaluations usually take
+            self.polls += 1
+            yield self.__Jitter(min(max(self.latency, self.first), self.max))
+        wait = self.first
+        while True:
+            self.polls += 1
+            yield self.__Jitter(wait)
+            wait = min(wait * self.factor, self.max)
+
+    def Observe(self, latencies):
+        """Update the latency estimate with newly observed evaluation latencies.
+
+        Parameters
+        ----------
+        latencies (list):
+            Seconds from submission to receipt of each evaluation value
+        """
+        if not latencies:
+            return
+        latencies = sorted(latencies)
+        # The median keeps a single straggler from dominating the estimate
+        median = latencies[len(latencies) // 2]
+        if self.latency is None:
+            self.latency = median
+        else:
+            self.latency = self.smoothing * median + (1 - self.smoothing) * self.latency
+        if self.store is not None:
+            self.store.SetMeta(self.LATENCY_KEY, self.latency)
+
+    def __Jitter(self, wait):
+        return max(0.0, wait * random.uniform(1 - self.jitter, 1 + self.jitter))
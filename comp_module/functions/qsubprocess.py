@@ -1,6 +1,22 @@
 #!/usr/local/bin/python
 from subprocess import check_output, CalledProcessError
-from status import StatusEnum
+try:
+    from .status import StatusEnum
+    from .polling import PollingPolicy
+    from .aio import CheckOutput
+    from .watcher import DirectoryWatcher
+    from .metrics import RunMetrics
+    from .journal import SendJournal
+    from .ratelimit import RateLimiter
+except ImportError:
+    from status import StatusEnum
+    from polling import PollingPolicy
+    from aio import CheckOutput
+    from watcher import DirectoryWatcher
+    from metrics import RunMetrics
+    from journal import SendJournal
+    from ratelimit import RateLimiter
+import glob
 import os
 import random
 import time
@@ -8,7 +24,11 @@ import string
 import json
 from datetime import datetime
 
-SLEEP_TIME = 60
+# Default settings of the job-array mode (PBS Pro); Torque uses {"option": "-t", "index": "PBS_ARRAYID"}
+DEFAULT_ARRAY = {"option": "-J", "index": "PBS_ARRAY_INDEX"}
+# Number of ticks without file events in which an output file that is not an evaluation value
+# is read again before the job is resolved with an error
+PARSE_RETRIES = 3
 
 class QsubProcess:
     """Class for sending solutions to Qsub and receiving evaluations.
@@ -23,9 +43,15 @@ class QsubProcess:
         Command script for executing send and receive operations using Qsub.
     model: string
         Model information (optional).
+    polling: dict
+        Settings of the polling interval (see PollingPolicy).
+    array: dict or bool
+        Settings of the job-array mode (see DEFAULT_ARRAY). If given, a batch is submitted as one array job.
+    rate: dict
+        "rate" settings of the configuration file (see RateLimiter).
 
     """
-    def __init__(self, sm, fp, script, model=None):
+    def __init__(self, sm, fp, script, model=None, polling=None, array=None, rate=None):
         # Record status using sm
         self.sm = sm
         # Store the class for file processing
@@ -40,6 +66,29 @@ class QsubProcess:
         self.__send_value_list = []
         
         self.__result_list =[]
+        # Settings of the polling interval
+        self.__polling = polling
+        # Limit of the qsub commands, shared with other processes
+        # (results are read from the output files, so polling does not call PBS)
+        self.__submit_limit = RateLimiter.FromConfig("qsub", "submit", rate)
+        # Time when the solutions were sent
+        self.__sent_time = None
+        # State of the receiving process
+        self.__positions = []
+        self.__pending = []
+        self.__received_time = []
+        self.__policy = None
+        self.__watcher = None
+        # Timings of this run
+        self.metrics = RunMetrics()
+        # Journal of the submitted jobs (removed when every evaluation value is received)
+        self.__journal = None
+        # Settings of the job-array mode (None if each solution is submitted as its own job)
+        if array is True:
+            array = DEFAULT_ARRAY
+        self.__array = dict(DEFAULT_ARRAY, **array) if array else None
+        # Files shared by the subjobs of an array job (deleted when every result is received)
+        self.__array_files = []
         # Generate template
         if model:
             self.__template = string.Template(script).safe_substitute({"MODEL": model})
@@ -53,117 +102,373 @@ class QsubProcess:
         ----------
         datalist(list): List of solutions to be sent.
         """
+        send_data = self.__BeginSend(send_data)
+        if not send_data:
+            return
+        try:
+            with self.metrics.Phase("submit"):
+                if self.__UseArray(send_data):
+                    # Submit the whole batch as one array job
+                    file_name = self.__CreateArrayScript(send_data)
+                    self.__submit_limit.Acquire()
+                    start = time.perf_counter()
+                    check_output(
+                        args=self.__ArrayCommand(file_name, len(send_data)),
+                        shell=True,
+                        text=True
+                    )
+                    self.metrics.Submitted(time.perf_counter() - start)
+                    self.__ArraySubmitted(send_data)
+                else:
+                    for data in send_data:
+                        file_name = self.__CreateScript(data)
+
+                        # Execute the generated file
+                        # ----- Add exception handling for failed execution
+                        self.__submit_limit.Acquire()
+                        start = time.perf_counter()
+                        send_stdout = check_output(
+                            args=f"qsub {file_name}",
+                            shell=True,
+                            text=True
+                        )
+                        self.metrics.Submitted(time.perf_counter() - start)
+                        self.__Submitted(data, file_name, send_stdout)
+            self.__EndSend()
+        except:
+            self.__SendingError()
+            exit()
+
+    async def SendProcessAsync(self, send_data: list):
+        """Process for sending solutions with asyncio subprocesses.
+        Raises the error instead of exiting when a submission fails.
+
+        Parameters
+        ----------
+        datalist(list): List of solutions to be sent.
+        """
+        send_data = self.__BeginSend(send_data)
+        if not send_data:
+            return
+        try:
+            with self.metrics.Phase("submit"):
+                if self.__UseArray(send_data):
+                    # Submit the whole batch as one array job
+                    file_name = self.__CreateArrayScript(send_data)
+                    await self.__submit_limit.AcquireAsync()
+                    start = time.perf_counter()
+                    await CheckOutput(self.__ArrayCommand(file_name, len(send_data)))
+                    self.metrics.Submitted(time.perf_counter() - start)
+                    self.__ArraySubmitted(send_data)
+                else:
+                    for data in send_data:
+                        file_name = self.__CreateScript(data)
+                        # Execute the generated file without blocking the event loop
+                        await self.__submit_limit.AcquireAsync()
+                        start = time.perf_counter()
+                        send_stdout = await CheckOutput(f"qsub {file_name}")
+                        self.metrics.Submitted(time.perf_counter() - start)
+                        self.__Submitted(data, file_name, send_stdout)
+            self.__EndSend()
+        except BaseException:
+            self.__SendingError()
+            raise
+
+    def __BeginSend(self, send_data):
+        # Reset the lists and return the solutions that have not been sent before
         # Clear each file
         self.__send_file_list.clear()
         self.__ofile_list.clear()
         self.__efile_list.clear()
         self.__send_value_list.clear()
         self.__result_list.clear()
+        self.__array_files.clear()
 
         # Send data (solutions) one by one
         self.sm.SetStatus(StatusEnum.SOLUTION_SENDING)
         # Remove previously sent solutions
-        send_data, self.__result_list = self.fp.CheckSolution(values=send_data)
+        with self.metrics.Phase("dedup"):
+            send_data, self.__result_list = self.fp.CheckSolution(values=send_data)
         if not send_data:
+            # Every solution has been sent before; its results are returned by GetProcess
             self.sm.SetStatus(StatusEnum.PREVIOUSLY_SOLUTION)
-            exit()
-        try:
+        else:
+            self.__journal = SendJournal.Create(self.sm.recipient, self.sm.number)
+        return send_data
+
+    def __CreateScript(self, data):
+        # Write the job script of a solution and return its file name
+        # Get the current time to include in the file name
+        date = datetime.now().strftime("%Y%m%d")
+        # Substitute the solution into the template
+        script = string.Template(self.__template).safe_substitute({"SOLUTION": json.dumps(data)})
+        # Generate a file name
+        file_name = "tmp_" + date + "_" + "{:010d}".format(random.randint(0, 10**10)) + ".sh"
+
+        # Input the execution script into the file and generate it
+        with open(file_name, "w") as f:
+            f.write(script)
+        return file_name
+
+    def __UseArray(self, send_data):
+        # An array job needs at least two subjobs
+        return self.__array is not None and len(send_data) > 1
+
+    def __CreateArrayScript(self, send_data):
+        # Write the input file (one solution per line) and the array job script; return the script file name
+        date = datetime.now().strftime("%Y%m%d")
+        base = os.path.abspath("tmp_" + date + "_" + "{:010d}".format(random.randint(0, 10**10)))
+        file_name = os.path.basename(base) + ".sh"
+        input_file = base + ".jsonl"
+        with open(input_file, "w") as f:
             for data in send_data:
-                # Get the current time to include in the file name
-                time = datetime.now().strftime("%Y%m%d")
-                # Substitute the solution into the template
-                script = string.Template(self.__template).safe_substitute({"SOLUTION": json.dumps(data)})
-                # Generate a file name
-                file_name = "tmp_" + time + "_" + "{:010d}".format(random.randint(0, 10**10)) + ".sh"
-
-                # Input the execution script into the file and generate it
-                with open(file_name, "w") as f:
-                    f.write(script)
-
-                # Execute the generated file
-                # ----- Add exception handling for failed execution
-                send_stdout = check_output(
-                    args=f"qsub {file_name}",
-                    shell=True,
-                    text=True
-                )
-                
-                
-                # Get the absolute path of the generated file
-                create_path = os.path.abspath(os.path.dirname(file_name))
-                # Add the expected file names to the respective file lists
-                self.__send_file_list.append(file_name)
-                self.__ofile_list.append(f"{create_path}/{file_name}.o{send_stdout.split('.')[0]}")
-                self.__efile_list.append(f"{create_path}/{file_name}.e{send_stdout.split('.')[0]}")
-                # Save the solution to the list
-                self.__send_value_list.append(data)
-            self.fp.SolutionRestore(self.__send_value_list)
-            self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
-        except:
-            self.sm.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
-            exit()
+                f.write(json.dumps(data) + "\n")
+
+        # The shebang and the PBS directives must stay at the top of the script
+        lines = self.__template.split("\n")
+        header = 0
+        while header < len(lines) and lines[header].startswith("#"):
+            header += 1
+        body = "\n".join(lines[header:]).replace("'${SOLUTION}'", "${SOLUTION}")
+        body = string.Template(body).safe_substitute({"SOLUTION": '"${ECOW_SOLUTION}"'})
+        # Each subjob reads the line of its index and writes its output to <base>.out.<index>
+        # (renamed when the subjob ends, so a complete file means a finished subjob)
+        output = base + ".out.${ECOW_INDEX}"
+        script = "\n".join(lines[:header] + [
+            f"ECOW_INDEX=${{{self.__array['index']}}}",
+            f'ECOW_SOLUTION=$(sed -n "$((ECOW_INDEX + 1))p" {input_file})',
+            f'exec > "{output}.tmp"',
+            f"trap 'mv \"{output}.tmp\" \"{output}\"' EXIT",
+            body
+        ])
+        with open(file_name, "w") as f:
+            f.write(script)
+        self.__array_files.extend([file_name, input_file])
+        return file_name
+
+    def __ArrayCommand(self, file_name, size):
+        return f"qsub {self.__array['option']} 0-{size - 1} {file_name}"
+
+    def __ArraySubmitted(self, send_data):
+        # Map each solution to the output file of its array index
+        base = self.__array_files[1][:-len(".jsonl")]
+        array_files = [os.path.abspath(file) for file in self.__array_files]
+        for k, data in enumerate(send_data):
+            self.__send_file_list.append(None)
+            self.__ofile_list.append(f"{base}.out.{k}")
+            self.__efile_list.append(None)
+            self.__send_value_list.append(data)
+            self.__journal.Sent({"key": self.__ofile_list[-1], "value": data, "script": None,
+                                 "ofile": self.__ofile_list[-1], "efile": None, "array": array_files})
+
+    def __Submitted(self, data, file_name, send_stdout):
+        # Get the absolute path of the generated file
+        create_path = os.path.abspath(os.path.dirname(file_name))
+        # Add the expected file names to the respective file lists
+        self.__send_file_list.append(file_name)
+        self.__ofile_list.append(f"{create_path}/{file_name}.o{send_stdout.split('.')[0]}")
+        self.__efile_list.append(f"{create_path}/{file_name}.e{send_stdout.split('.')[0]}")
+        # Save the solution to the list
+        self.__send_value_list.append(data)
+        self.__journal.Sent({"key": self.__ofile_list[-1], "value": data, "script": os.path.abspath(file_name),
+                             "ofile": self.__ofile_list[-1], "efile": self.__efile_list[-1]})
+
+    def __SendingError(self):
+        # Keep the journal of the jobs submitted so far for re-receiving
+        if self.__journal is not None:
+            self.__journal.Close()
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
+
+    def __EndSend(self):
+        self.fp.SolutionRestore(self.__send_value_list)
+        self.__sent_time = time.time()
+        self.metrics.Sent()
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
+
+    def Resume(self, entries):
+        """Reattach to jobs submitted by earlier runs, so that only their evaluation values are received.
+
+        Parameters
+        ----------
+        entries (list):
+            Entries of the journals of the earlier runs (see SendJournal)
+        """
+        self.__send_file_list = [e['script'] for e in entries]
+        self.__ofile_list = [e['ofile'] for e in entries]
+        self.__efile_list = [e['efile'] for e in entries]
+        self.__send_value_list = [e['value'] for e in entries]
+        self.__result_list = [None for _ in entries]
+        # Files of the array jobs are deleted when every result is received
+        self.__array_files = list(dict.fromkeys(file for e in entries for file in e.get('array') or []))
+        if not entries:
+            self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
+            return
+        # Carry the entries over to the journal of this run
+        self.__journal = SendJournal.Create(self.sm.recipient, self.sm.number)
+        for e in entries:
+            self.__journal.Sent(e)
+        self.sm.SetStatus(StatusEnum.SOLUTION_SENT)
 
     def GetProcess(self):
         """Process for receiving evaluation values."""
-        # Lists to store actually generated files
-        ofileList = []
-        efileList = []
-        
+        for n, item in self.__Receive():
+            self.__result_list[n] = item
+        return self.__result_list
+
+    def GetIter(self):
+        """Yield each evaluation value as soon as it is received.
+        Results of previously sent solutions are yielded first."""
+        for _, item in self.__Receive():
+            yield item
+
+    def __Receive(self):
+        # Yield (position in the result list, result) pairs as they become available
+        yield from self.__Cached()
+        if not self.__BeginReceive():
+            return
+        delays = self.__policy.Delays()
+        try:
+            while self.__pending:
+                # Wait until an output file is written or the next check
+                woken = self.__watcher.Wait(self.__Delay(delays))
+                self.metrics.Poll()
+                yield from self.__Arrived(not woken)
+        except GeneratorExit:
+            # Stopped before all evaluation values were received
+            self.__Unreceived()
+            raise
+        except Exception:
+            self.__Unreceived()
+            exit()
+        finally:
+            self.__watcher.Close()
+        self.__EndReceive()
+
+    async def ReceiveAsync(self):
+        """Yield (position, result) pairs as soon as they are received, without blocking the event loop.
+        The position is the index of the solution in the list given to the sending process."""
+        for pair in self.__Cached():
+            yield pair
+        if not self.__BeginReceive():
+            return
+        delays = self.__policy.Delays()
+        try:
+            while self.__pending:
+                # Wait until an output file is written or the next check
+                woken = await self.__watcher.WaitAsync(self.__Delay(delays))
+                self.metrics.Poll()
+                for pair in self.__Arrived(not woken):
+                    yield pair
+        except BaseException:
+            self.__Unreceived()
+            raise
+        finally:
+            self.__watcher.Close()
+        self.__EndReceive()
+
+    def __Cached(self):
+        # Return the results that are known before receiving
+        return [(n, item) for n, item in enumerate(self.__result_list) if item is not None]
+
+    def __BeginReceive(self):
+        # Prepare for receiving; return False if there is nothing to receive
         if not self.__send_value_list:
-            return self.__result_list
+            return False
         
+        # Positions of the sent solutions in the result list
+        self.__positions = [n for n, item in enumerate(self.__result_list) if item is None]
+        # Indexes of the sent solutions whose evaluation values have not been received yet
+        self.__pending = list(range(len(self.__send_value_list)))
+        # Time when each evaluation value was received
+        self.__received_time = []
+        # Number of times the output file of each job could not be read as an evaluation value {index: count}
+        self.__parse_failures = {}
+
         # Receive
         self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING)
-        try:
-            while True:
-                # Wait for 1 minute
-                time.sleep(SLEEP_TIME)
-
-                # Check if a response to the solution has arrived
-                # Check if the expected file names have been generated
-                for get in self.__ofile_list:
-                    # It can also be done using os.path.exists()
-                    if os.path.isfile(get):
-                        ofileList.append(get)
-                # Check if the expected file names have been generated
-                for get in self.__efile_list:
-                    if os.path.isfile(get):
-                        efileList.append(get)
-
-                # Check the consistency between the expected file names and the actually generated file names
-                if (set(ofileList) == set(self.__ofile_list)) and (set(efileList) == set(self.__efile_list)):
-                    # Exit the loop if everything is present
-                    break
-        except:
-            self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING_ERROR)
-            exit()
+        self.__policy = PollingPolicy(self.__polling, self.fp.store)
+        # Output files are generated in the directory of the job scripts
+        self.__watcher = DirectoryWatcher(os.path.dirname(self.__ofile_list[0]))
+        return True
+
+    def __Arrived(self, timeout):
+        # Return (position, result) pairs of the jobs whose output files have been generated
+        # (timeout: the wait ended without file events)
+        received = []
+        # Check if a response to the solution has arrived
+        # Check if the expected files have been completely written (one directory scan for all jobs)
+        names = self.__watcher.Scan()
+        arrived = [k for k in self.__pending if os.path.basename(self.__ofile_list[k]) in names and (self.__efile_list[k] is None or os.path.basename(self.__efile_list[k]) in names)]
+        for k in arrived:
+            error = None
+            try:
+                with open(self.__ofile_list[k], 'r') as f:
+                    tmp = json.loads(f.read())
+                objective, info = tmp['objective'], tmp['info']
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                # The file may still be rewritten (e.g. copied again by PBS), so it is read again
+                # until it has failed in PARSE_RETRIES ticks without file events
+                self.__parse_failures[k] = self.__parse_failures.get(k, 0) + (1 if timeout else 0)
+                if self.__parse_failures[k] < PARSE_RETRIES:
+                    continue
+                error = self.__OutputError(k, e)
+            self.__parse_failures.pop(k, None)
+            self.__pending.remove(k)
+            self.__received_time.append(time.time())
+            self.metrics.Received()
+            self.__journal.Done(self.__ofile_list[k])
+            # Delete the generated files
+            self.__FileDelete([self.__send_file_list[k], self.__ofile_list[k], self.__efile_list[k]])
+            data = self.__send_value_list[k]
+            if error is not None:
+                received.append((self.__positions[k], {str(data): {"objective": None, "info": None, "error": error}}))
+                continue
+            # Save each evaluation value as soon as it is received
+            self.fp.SolutionRestore([data], [objective], [info])
+            received.append((self.__positions[k], {str(data): {"objective": objective, "info": info}}))
+        return received
+
+    def __Delay(self, delays):
+        # Output files that could not be read are read again without waiting for the longer intervals
+        delay = next(delays)
+        if self.__parse_failures:
+            delay = min(delay, self.__policy.first)
+        return delay
 
-        # List to store evaluation values generated from the files
-        objectives = []
-        info = []
-        res_values = []
-        # Retrieve evaluation values from files where they should be input
-        for get in self.__ofile_list:
-            with open(get, 'r') as f:
-                tmp = json.loads(f.read())
-                objectives.append(tmp['objective'])
-                info.append(tmp['info'])
-                res_values.append(tmp)
-
-        # Delete all generated files
-        for deletefile in [self.__send_file_list, self.__ofile_list, self.__efile_list]:
-            self.__FileDelete(deletefile)
-
-        # Return evaluation values
-        self.fp.SolutionRestore(self.__send_value_list,objectives,info)
+    def __OutputError(self, k, e):
+        # Describe an output file that does not hold an evaluation value, with the error output of the job
+        error = f"Invalid output of the job ({os.path.basename(self.__ofile_list[k])}): {e.__class__.__name__}: {e}"
+        if self.__efile_list[k] is not None:
+            try:
+                with open(self.__efile_list[k], 'r') as f:
+                    stderr = f.read().strip()
+            except OSError:
+                stderr = ''
+            if stderr:
+                error += f"\n{stderr}"
+        return error
+
+    def __EndReceive(self):
+        if self.__sent_time is not None:
+            # Learn how long evaluations take for the next run
+            self.__policy.Observe([t - self.__sent_time for t in self.__received_time])
+        if self.__array_files:
+            # Delete the files of the array jobs, including the outputs written by PBS itself
+            scripts = [file for file in self.__array_files if file.endswith(".sh")]
+            self.__FileDelete(self.__array_files + [file for script in scripts for file in glob.glob(glob.escape(script) + ".[oe]*")])
+            self.__array_files.clear()
+        self.__journal.Remove()
         self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVED)
-        extracted_data = [{str(i):{"objective": solution["objective"], "info": solution["info"]}} for i,solution in zip(self.__send_value_list,res_values)]
-        for i, item in enumerate(self.__result_list):
-            if item == None:
-                self.__result_list[i] = extracted_data.pop(0)
-        return self.__result_list
+
+    def __Unreceived(self):
+        # Keep the journal so that the jobs that have not been received can be received again (-re)
+        self.__journal.Close()
+        self.sm.SetStatus(StatusEnum.EVALUATION_RECEIVING_ERROR)
 
     def __FileDelete(self, filelist):
         for file in filelist:
+            if file is None:
+                # Shared by the subjobs of an array job
+                continue
             # It can also be done using os.unlink()
             os.remove(file)
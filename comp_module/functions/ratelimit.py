@@ -0,0 +1,99 @@
+#!/usr/local/bin/python
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+
+# Variable to store the file directory path
+FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Directory of the bucket files (.<name>.rate), shared by every process
+RATE_DIRECTORY = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files'))
+
+
+class RateLimiter:
+    """Token bucket shared by every process that uses the same name.
+
+    The bucket holds up to `burst` tokens and is refilled at `rate` tokens per second.
+    Each command takes one token and waits while the bucket is empty. The state of the
+    bucket is kept in a locked file, so runs in other processes (and the daemon) draw
+    from the same bucket.
+
+    Parameters
+    ----------
+    name: string
+        Name of the bucket, e.g. "opt_submit".
+    rate: float
+        Tokens added per second (None or 0: no limit).
+    burst: int
+        Maximum number of tokens (max(1, rate) if not given).
+    """
+    def __init__(self, name, rate=None, burst=None):
+        self.name = name
+        self.rate = float(rate) if rate else None
+        self.burst = float(burst) if burst else max(1.0, self.rate or 1.0)
+        self.path = os.path.join(RATE_DIRECTORY, f".{name}.rate")
+        # The file lock does not exclude threads of the same process
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def FromConfig(cls, backend, kind, config):
+        """Return the limiter of one kind of command of a backend.
+
+        Parameters
+        ----------
+        backend (string):
+            "opt" or "qsub"
+        kind (string):
+            "submit" or "poll"
+        config (dict):
+            "rate" settings of the configuration file (no limit if not given)
+        """
+        settings = (config or {}).get(backend) or {}
+        return cls(f"{backend}_{kind}", settings.get(kind), settings.get("burst"))
+
+    def Acquire(self):
+        """Take one token, sleeping until one is available; return the seconds waited."""
+        waited = 0.0
+        while True:
+            delay = self.__Take()
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def AcquireAsync(self):
+        """Take one token without blocking the event loop; return the seconds waited."""
+        waited = 0.0
+        while True:
+            delay = self.__Take()
+            if delay <= 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def __Take(self):
+        # Take a token if there is one and return 0, otherwise return the seconds until the next one
+        if self.rate is None:
+            return 0
+        with self.__lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.read(fd, 4096)
+                now = time.time()
+                try:
+                    state = json.loads(data)
+                    tokens = min(self.burst, state["tokens"] + max(0.0, now - state["time"]) * self.rate)
+                except (ValueError, KeyError, TypeError):
+                    # New (or damaged) bucket: start full
+                    tokens = self.burst
+                delay = 0 if tokens >= 1 else (1 - tokens) / self.rate
+                if delay == 0:
+                    tokens -= 1
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, json.dumps({"tokens": tokens, "time": now}).encode(), 0)
+            finally:
+                os.close(fd)
+        return delay
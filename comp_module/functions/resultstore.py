@@ -0,0 +1,438 @@
+#!/usr/local/bin/python
+import ast
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+try:
+    from .columnstore import ColumnStore, UNKNOWN_TIME
+    from .archive import ResultArchive
+except ImportError:
+    from columnstore import ColumnStore, UNKNOWN_TIME
+    from archive import ResultArchive
+
+# Seconds to wait for another process holding the database lock
+LOCK_TIMEOUT = 60
+# Default number of results kept in memory by ResultCache
+CACHE_SIZE = 100000
+
+
+def CanonicalSolution(solution):
+    """Convert a solution into the canonical form used for keys.
+
+    Tuples become lists and integers become floats, so that solutions that
+    compare equal in Python (e.g. [1, 2] and [1.0, 2.0]) share a key.
+
+    Parameters
+    ----------
+    solution (list):
+        Solution to convert
+    """
+    if isinstance(solution, (list, tuple)):
+        return [CanonicalSolution(s) for s in solution]
+    if isinstance(solution, int) and not isinstance(solution, bool):
+        return float(solution)
+    return solution
+
+
+def CanonicalKey(solution):
+    """Return the hash key of a solution.
+
+    Parameters
+    ----------
+    solution (list):
+        Solution to hash
+    """
+    text = json.dumps(CanonicalSolution(solution), separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Bounded in-memory LRU cache of evaluated results, keyed by CanonicalKey.
+
+    Only results with an evaluation value are kept, since the values of sent
+    solutions may still be filled in by another process.
+
+    Parameters
+    ----------
+    size: int
+        Maximum number of results kept in memory (0 disables the cache).
+    """
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def Get(self, key):
+        """Return the cached entry for the key, or None (counted as a hit or a miss).
+
+        Parameters
+        ----------
+        key (string):
+            CanonicalKey of the solution
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def Put(self, key, entry):
+        """Cache an entry {str(solution): {"objective": ..., "info": ...}}.
+
+        An entry that is already cached is kept, in the same way as the store keeps stored values.
+
+        Parameters
+        ----------
+        key (string):
+            CanonicalKey of the solution
+        entry (dict):
+            Entry to cache
+        """
+        if self.size <= 0 or list(entry.values())[0].get("objective") is None:
+            return
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                return
+            self.__entries[key] = entry
+            if len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+
+    def Info(self):
+        """Return the hit and miss counters and the number of cached results."""
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.__entries), "maxsize": self.size}
+
+    def Clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class ResultStore:
+    """Indexed store of solutions and their evaluation values.
+
+    Each solution is stored once under its canonical hash key, so looking up
+    or updating a solution does not depend on the number of stored results.
+
+    Parameters
+    ----------
+    path: string
+        Path to the database file.
+    legacy_file: string
+        Path to a JSON result file written by older versions.
+        It is imported the first time the store is opened.
+    columns: bool
+        Also keep the numeric solutions in a ColumnStore (<path without .db>.cols),
+        which is filled with the stored results the first time the store is opened.
+    top: int
+        Number of single-objective results kept by the archive of the best results
+        (defaults to archive.TOP_SIZE).
+    """
+    def __init__(self, path, legacy_file=None, columns=True, top=None):
+        self.path = path
+        self.__conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        with self.__conn:
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " key TEXT NOT NULL UNIQUE,"
+                " label TEXT NOT NULL,"
+                " solution TEXT NOT NULL,"
+                " objective TEXT,"
+                " info TEXT)"
+            )
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            ColumnStore.CreateTables(self.__conn)
+            ResultArchive.CreateTables(self.__conn)
+        self.columns = ColumnStore(os.path.splitext(path)[0] + ".cols") if columns else None
+        self.archive = ResultArchive(top)
+        if legacy_file:
+            self.ImportJson(legacy_file)
+        if self.columns is not None:
+            self.__BuildColumns()
+        self.__BuildArchive()
+
+    def Lookup(self, solution, key=None):
+        """Return the stored entry of a solution.
+
+        Parameters
+        ----------
+        solution (list):
+            Solution to look up
+        key (string):
+            CanonicalKey of the solution, if already computed
+
+        Returns
+        --------
+        entry (dict):
+            {str(solution): {"objective": ..., "info": ...}}, or None if the solution is not stored.
+        """
+        row = self.__conn.execute(
+            "SELECT label, objective, info FROM results WHERE key = ?",
+            (key or CanonicalKey(solution),)
+        ).fetchone()
+        if row is None:
+            return None
+        return self.__ToEntry(row)
+
+    def Upsert(self, solutions, objectives, info, stored_at=None):
+        """Store solutions, filling in values that are still missing.
+
+        Values that are already stored are kept; only missing (None) values are replaced.
+
+        Parameters
+        ----------
+        solutions (list):
+            Solutions to store
+        objectives (list):
+            Evaluation values of the solutions
+        info (list):
+            'info' of the evaluation values
+        stored_at (float):
+            Time recorded in the columns for the evaluation values (the current time if not given,
+            columnstore.UNKNOWN_TIME for values whose time is not known)
+        """
+        rows = [
+            (CanonicalKey(s), str(s), json.dumps(s), self.__Dump(v), self.__Dump(i))
+            for s, v, i in zip(solutions, objectives, info)
+        ]
+        with self.__conn:
+            # Take the write lock first, so that the values found missing here are still missing below
+            self.__conn.execute("BEGIN IMMEDIATE")
+            evaluated = self.__Evaluated([r[0] for r in rows if r[3] is not None])
+            self.__conn.executemany(
+                "INSERT INTO results (key, label, solution, objective, info) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "objective = COALESCE(results.objective, excluded.objective), "
+                "info = COALESCE(results.info, excluded.info)",
+                rows
+            )
+            if self.columns is not None:
+                self.columns.Write(self.__conn, [(r[0], s, v) for r, s, v in zip(rows, solutions, objectives)], stored_at)
+            # Only values that were missing are stored, so only those can enter the archive
+            self.archive.Add(self.__conn, (
+                (r[0], v) for r, v in zip(rows, objectives) if v is not None and r[0] not in evaluated
+            ))
+
+    def Entries(self):
+        """Iterate over all stored entries in insertion order."""
+        for row in self.__conn.execute("SELECT label, objective, info FROM results ORDER BY seq"):
+            yield self.__ToEntry(row)
+
+    def Solutions(self, after=0):
+        """Iterate over the stored solutions in insertion order.
+
+        Parameters
+        ----------
+        after (int):
+            Only solutions stored after this sequence number are returned
+
+        Yields
+        --------
+        (seq, solution) pairs, where seq is the sequence number of the solution.
+        """
+        for seq, solution in self.__conn.execute(
+            "SELECT seq, solution FROM results WHERE seq > ? ORDER BY seq", (after,)
+        ):
+            yield seq, json.loads(solution)
+
+    def Columns(self):
+        """Memory-map the numeric solutions and their evaluation values (see ColumnStore.Read).
+
+        Returns
+        --------
+        (solutions, objectives, times), or None if the store does not keep columns.
+        """
+        if self.columns is None:
+            return None
+        return self.columns.Read(self.__conn)
+
+    def ColumnInfo(self, rows=None):
+        """Return the 'info' of rows of the columns.
+
+        Parameters
+        ----------
+        rows (list):
+            Row numbers (all rows if not given)
+
+        Returns
+        --------
+        info (list):
+            'info' of each row, in the order of rows
+        """
+        query = "SELECT c.row, r.info FROM columns c JOIN results r ON r.key = c.key"
+        if rows is None:
+            return [self.__Load(i) for _, i in self.__conn.execute(query + " ORDER BY c.row")]
+        found = {}
+        rows = [int(r) for r in rows]
+        # Stay below the limit on the number of parameters of SQLite
+        for start in range(0, len(rows), 500):
+            part = rows[start:start + 500]
+            found.update(self.__conn.execute(
+                query + f" WHERE c.row IN ({','.join('?' * len(part))})", part
+            ).fetchall())
+        return [self.__Load(found.get(r)) for r in rows]
+
+    def Front(self):
+        """Return the non-dominated results of multi-objective evaluation values (all objectives minimized).
+
+        The results are read from the archive, so this does not depend on the number of stored results.
+
+        Returns
+        --------
+        entries (list):
+            {str(solution): {"objective": ..., "info": ...}} of each result, ordered by the first objective
+        """
+        return self.__EntriesOf(self.archive.Front(self.__conn))
+
+    def Best(self, k=None):
+        """Return the results with the smallest single-objective evaluation values.
+
+        Parameters
+        ----------
+        k (int):
+            Number of results (all results kept by the archive if not given)
+
+        Returns
+        --------
+        entries (list):
+            {str(solution): {"objective": ..., "info": ...}} of each result, best first
+        """
+        return self.__EntriesOf(self.archive.Best(self.__conn, k))
+
+    def Count(self):
+        """Return the number of stored solutions."""
+        return self.__conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def GetMeta(self, name):
+        """Return a value saved with SetMeta, or None if it is not saved.
+
+        Parameters
+        ----------
+        name (string):
+            Name of the value
+        """
+        row = self.__conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def SetMeta(self, name, value):
+        """Save a value related to the store (e.g. statistics of the recipient).
+
+        Parameters
+        ----------
+        name (string):
+            Name of the value
+        value:
+            JSON serializable value
+        """
+        with self.__conn:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                (name, json.dumps(value))
+            )
+
+    def ImportJson(self, filename):
+        """Import a JSON result file written by older versions (only once per store).
+
+        Parameters
+        ----------
+        filename (string):
+            File name
+        """
+        if self.GetMeta("imported_json") is not None:
+            return
+        solutions, objectives, info = [], [], []
+        if os.path.exists(filename) and os.path.getsize(filename) != 0:
+            with open(filename, 'r') as f:
+                now_data = json.load(f)
+            for d in now_data:
+                key = list(d.keys())[0]
+                solution = ast.literal_eval(key)
+                if not isinstance(solution, list):
+                    continue
+                solutions.append(solution)
+                objectives.append(d[key].get("objective"))
+                info.append(d[key].get("info"))
+        # The files do not record when the values were evaluated
+        self.Upsert(solutions, objectives, info, stored_at=UNKNOWN_TIME)
+        self.SetMeta("imported_json", filename)
+
+    def Close(self):
+        if self.columns is not None:
+            self.columns.Close()
+        self.__conn.close()
+
+    def __BuildColumns(self):
+        # Copy the results stored before the columns existed (only once per store)
+        if self.GetMeta("columns_built") is not None:
+            return
+        with self.__conn:
+            # Hold the write lock while checking again, so only one process copies the results
+            self.__conn.execute("BEGIN IMMEDIATE")
+            if self.__conn.execute("SELECT 1 FROM meta WHERE name = 'columns_built'").fetchone() is None:
+                self.columns.Write(self.__conn, (
+                    (key, json.loads(solution), self.__Load(objective))
+                    for key, solution, objective in self.__conn.execute(
+                        "SELECT key, solution, objective FROM results ORDER BY seq"
+                    ).fetchall()
+                ), stored_at=UNKNOWN_TIME)  # The store does not record when the values were evaluated
+                self.__conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('columns_built', 'true')")
+
+    def __BuildArchive(self):
+        # Add the results stored before the archive existed (only once per store)
+        if self.GetMeta("archive_built") is not None:
+            return
+        with self.__conn:
+            self.__conn.execute("BEGIN IMMEDIATE")
+            if self.__conn.execute("SELECT 1 FROM meta WHERE name = 'archive_built'").fetchone() is None:
+                self.archive.Add(self.__conn, (
+                    (key, json.loads(objective))
+                    for key, objective in self.__conn.execute(
+                        "SELECT key, objective FROM results WHERE objective IS NOT NULL ORDER BY seq"
+                    ).fetchall()
+                ))
+                self.__conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('archive_built', 'true')")
+
+    def __Evaluated(self, keys):
+        # Keys among keys whose evaluation value is already stored
+        evaluated = set()
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            evaluated.update(k for k, in self.__conn.execute(
+                f"SELECT key FROM results WHERE objective IS NOT NULL AND key IN ({','.join('?' * len(part))})", part
+            ))
+        return evaluated
+
+    def __EntriesOf(self, keys):
+        # Entries of the keys, in the order of keys
+        found = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            for key, label, objective, info in self.__conn.execute(
+                f"SELECT key, label, objective, info FROM results WHERE key IN ({','.join('?' * len(part))})", part
+            ):
+                found[key] = self.__ToEntry((label, objective, info))
+        return [found[k] for k in keys if k in found]
+
+    def __ToEntry(self, row):
+        label, objective, info = row
+        return {label: {"objective": self.__Load(objective), "info": self.__Load(info)}}
+
+    @staticmethod
+    def __Dump(value):
+        # Keep missing values as NULL so that they can be filled in later
+        return None if value is None else json.dumps(value)
+
+    @staticmethod
+    def __Load(value):
+        return None if value is None else json.loads(value)
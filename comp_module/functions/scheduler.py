@@ -0,0 +1,169 @@
+#!/usr/local/bin/python
+try:
+    from .divide import Process
+    from .config import LoadConfig
+except ImportError:
+    from divide import Process
+    from config import LoadConfig
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+import threading
+import os
+
+# Variable to store the file directory path
+FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Path to the configuration file
+CONFIGFILE = os.path.normpath(os.path.join(FILE_DIRECTORY, './__config_files/__config.json'))
+# Default limits when the configuration file has no "scheduler" key
+DEFAULT_SCHEDULER = {"workers": 4, "per_target": 1}
+
+
+class Scheduler:
+    """Runs batches of solutions for several recipients (targets) at the same time.
+
+    Each batch is tagged with a target ("opt_<matchID>", "qsub_<name>", "qsub_<name>_<model>" or "local").
+    Batches for different targets run concurrently, and each target keeps its own results store and status.
+    Batches for the same target are started in the order they were submitted.
+    Batches streamed with Stream run in the calling thread but count against the same limits.
+
+    Parameters
+    ----------
+    workers: int
+        Maximum number of batches running at the same time (scheduler.workers if not given).
+    per_target: int
+        Maximum number of batches running at the same time for one target (scheduler.per_target if not given).
+    """
+    def __init__(self, workers=None, per_target=None):
+        config = dict(DEFAULT_SCHEDULER)
+        config.update(LoadConfig(CONFIGFILE).get('scheduler') or {})
+        self.workers = max(1, int(workers or config['workers']))
+        self.per_target = max(1, int(per_target or config['per_target']))
+        self.__executor = ThreadPoolExecutor(max_workers=self.workers)
+        # Batches waiting for a free slot (target, values, future, stream, argv), in the order they were submitted
+        self.__pending = deque()
+        # Number of running batches for each target
+        self.__running = {}
+        self.__lock = threading.Lock()
+
+    def Submit(self, values, target=None, resume=False):
+        """Queue a batch of solutions and return a future resolved with its evaluation values.
+
+        Parameters
+        ----------
+        values (list):
+            Solutions to send
+        target (string):
+            Recipient of the solutions (the one in the configuration file if not given)
+        resume (boolean):
+            Instead of sending values, receive the evaluation values of solutions sent
+            to the target by runs that ended before receiving them (same as -re)
+
+        Returns
+        --------
+        future (concurrent.futures.Future):
+            Resolved with the same list as Run for this batch.
+        """
+        if target is not None:
+            # Check the target now rather than in the worker
+            Process.Target(LoadConfig(CONFIGFILE)['main'], target)
+        future = Future()
+        with self.__lock:
+            self.__pending.append((target, values, future, False, ['-re'] if resume else []))
+        self.__Dispatch()
+        return future
+
+    def Stream(self, values, target=None):
+        """Queue a batch of solutions and yield each evaluation value as soon as it is received.
+
+        The batch waits for a free slot like a submitted one, then runs in the calling thread.
+        Stopping the iteration frees the slot, and the solutions not yet received are kept for Resume.
+
+        Parameters
+        ----------
+        values (list):
+            Solutions to send
+        target (string):
+            Recipient of the solutions (the one in the configuration file if not given)
+        """
+        if target is not None:
+            Process.Target(LoadConfig(CONFIGFILE)['main'], target)
+        # Resolved when the batch gets a slot
+        slot = Future()
+        with self.__lock:
+            self.__pending.append((target, values, slot, True, []))
+        self.__Dispatch()
+        slot.result()
+        try:
+            yield from Process(values=values, argv=[], target=target, slots=self.per_target).runIter()
+        finally:
+            self.__Release(target)
+
+    def Map(self, batches):
+        """Run the batches and return their evaluation values in the same order.
+
+        Parameters
+        ----------
+        batches (list):
+            List of (target, solutions) pairs
+        """
+        futures = [self.Submit(values, target) for target, values in batches]
+        return [future.result() for future in futures]
+
+    def Shutdown(self, wait=True):
+        """Cancel the batches that have not started and stop the workers.
+
+        Parameters
+        ----------
+        wait (boolean):
+            Whether to wait for the running batches to finish
+        """
+        with self.__lock:
+            while self.__pending:
+                self.__pending.popleft()[2].cancel()
+        self.__executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Shutdown()
+
+    def __Dispatch(self):
+        # Start the oldest pending batches whose target has a free slot, while workers are free
+        with self.__lock:
+            # Batches whose target is busy, kept in the order they were submitted
+            waiting = deque()
+            while self.__pending and sum(self.__running.values()) < self.workers:
+                target, values, future, stream, argv = self.__pending.popleft()
+                if self.__running.get(target, 0) >= self.per_target:
+                    waiting.append((target, values, future, stream, argv))
+                    continue
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.__running[target] = self.__running.get(target, 0) + 1
+                if stream:
+                    # The caller of Stream runs the batch
+                    future.set_result(None)
+                else:
+                    self.__executor.submit(self.__Run, target, values, future, argv)
+            waiting.extend(self.__pending)
+            self.__pending = waiting
+
+    def __Run(self, target, values, future, argv):
+        # Run one batch in a worker thread
+        try:
+            result = Process(values=values, argv=argv, target=target, slots=self.per_target).run()
+        except SystemExit as e:
+            future.set_exception(RuntimeError(f"Run for {target} exited: {e}"))
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            self.__Release(target)
+
+    def __Release(self, target):
+        # Free the slot of a finished batch and start the next ones
+        with self.__lock:
+            self.__running[target] -= 1
+        self.__Dispatch()
@@ -1,8 +1,15 @@
 import os
-import csv
 import json
+import fcntl
+import sqlite3
 import datetime
 from enum import Enum, auto
+try:
+    from .metrics import Percentile, PERCENTILES
+    from .config import LoadConfig
+except ImportError:
+    from metrics import Percentile, PERCENTILES
+    from config import LoadConfig
 
 class StatusEnum(Enum):
     # ステータスの状態を表す
@@ -24,6 +31,8 @@ class StatusEnum(Enum):
     EVALUATION_RECEIVING_ERROR = auto()
     # Ctrl-Cで終了
     EXITED_WITH_CtrlC = auto()
+    # 終了ステータスを記録せずにプロセスが終了
+    EXITED_UNEXPECTEDLY = auto()
     
     def __str__(self):
         if self == StatusEnum.WAITING:
@@ -44,6 +53,23 @@ class StatusEnum(Enum):
             return "Evaluation Value Receiving Error"
         elif self == StatusEnum.EXITED_WITH_CtrlC:
             return "Exited with Ctrl-C"
+        elif self == StatusEnum.EXITED_UNEXPECTEDLY:
+            return "Exited Unexpectedly"
+
+
+# Statuses after which the next run for the same recipient may start
+TERMINAL_STATUSES = [str(StatusEnum.EVALUATION_RECEIVED),
+                     str(StatusEnum.EVALUATION_RECEIVING_ERROR),
+                     str(StatusEnum.SOLUTION_SENDING_ERROR),
+                     str(StatusEnum.PREVIOUSLY_SOLUTION),
+                     str(StatusEnum.EXITED_WITH_CtrlC),
+                     str(StatusEnum.EXITED_UNEXPECTEDLY)]
+
+# Seconds to wait for another process holding the database lock
+LOCK_TIMEOUT = 60
+
+# Number of runs kept in the metrics log
+METRICS_LIMIT = 1000
 
 
 class StatusManager():
@@ -52,6 +78,8 @@ class StatusManager():
     ----------
     recipient:
         Recipient of the solution.
+    slots:
+        Number of runs for the recipient that may be in progress at the same time.
     """
 
     # Variable to store the file directory path
@@ -61,23 +89,53 @@ class StatusManager():
     __CONFIGFILE = os.path.normpath(os.path.join(__FILEDIRECTORY, './__config_files/__config.json'))
 
     # Path to store the status
-    __STATUS_FILE = os.path.normpath(os.path.join(__FILEDIRECTORY, './__config_files/__status.csv'))
+    __STATUS_FILE = os.path.normpath(os.path.join(__FILEDIRECTORY, './__config_files/__status.db'))
 
-    def __init__(self, recipient):
+    # Directory of the ticket files of the run queue (one file per run, locked until the run finishes)
+    __QUEUE_DIRECTORY = os.path.normpath(os.path.join(__FILEDIRECTORY, './__config_files/__queue'))
+
+    def __init__(self, recipient, slots=1):
         # Store values in the configuration file
-        json_load = json.load(open(self.__CONFIGFILE, 'r'))
+        json_load = LoadConfig(self.__CONFIGFILE)
         status_json = json_load['status']
         self.max_row = status_json['limit']
 
         # Keep track of the recipient
         self.recipient = recipient
+        # Number of runs for the recipient allowed at the same time
+        self.slots = max(1, int(slots))
+
+        # Database storing one row per run
+        self.status_file = self.__STATUS_FILE
+        self.__conn = StatusManager.__Connect(self.status_file)
 
-        # Path to store the status in a CSV file
-        status_path = os.path.normpath(os.path.join(__file__, '../../__config_files/__status.csv'))
-        self.status_file = status_path
+        # Store the row of this run (set by New)
+        self.number = None
+        # Ticket file of this run, locked while the run is in progress
+        self.__ticket = None
 
-        # Store the position in the file
-        self.number = self.GetRowCount(self.status_file)
+    @staticmethod
+    def __Connect(status_file):
+        # Open the status database and create the table if needed
+        conn = sqlite3.connect(status_file, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS status ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " date TEXT NOT NULL,"
+                " recipient TEXT NOT NULL,"
+                " status TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS status_recipient ON status (recipient, id)")
+            # Metrics log: timings of each run (see RunMetrics.Summary)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics ("
+                " run INTEGER PRIMARY KEY,"
+                " recipient TEXT NOT NULL,"
+                " date TEXT NOT NULL,"
+                " summary TEXT NOT NULL)"
+            )
+        return conn
 
     
     # Function to display the status of solutions in the terminal
@@ -85,32 +143,67 @@ class StatusManager():
         """Function to display the status of solutions in the terminal
         """
         try:
-            status_file = os.path.normpath(os.path.join(__file__, '../../__config_files/__status.csv'))
-            with open(status_file, mode="r") as file:
-                reader = csv.reader(file)
-                print(f"{'date':<20} | {'sub_to':<10} | {'status':<15}")
-                print("-" * 45)
-                # Convert the reader to a list
-                data_list = list(reader)
-                # Reverse the list and print the first 10 rows
-                for row in reversed(data_list):
-                    date, recipient, status = row
-                    print(f"{date:<20} | {recipient:<10} | {status:<15}")
-                print("-" * 45)
-        except FileNotFoundError:
-            print("Status file not found.")
+            print(StatusManager.Report())
+        except sqlite3.Error as e:
+            print(f"Unable to read the status. Error: {e}")
             exit()
 
+    @staticmethod
+    def Report():
+        """Return the status of the latest runs and the percentiles of their timings as text."""
+        json_load = LoadConfig(StatusManager.__CONFIGFILE)
+        conn = StatusManager.__Connect(StatusManager.__STATUS_FILE)
+        try:
+            rows = conn.execute(
+                "SELECT date, recipient, status FROM status ORDER BY id DESC LIMIT ?",
+                (json_load['status']['limit'],)
+            ).fetchall()
+            summaries = [json.loads(row[0]) for row in conn.execute("SELECT summary FROM metrics ORDER BY run DESC")]
+        finally:
+            conn.close()
+        lines = [f"{'date':<20} | {'sub_to':<10} | {'status':<15}", "-" * 45]
+        # Print the newest rows first
+        for date, recipient, status in rows:
+            lines.append(f"{date:<20} | {recipient:<10} | {status:<15}")
+        lines.append("-" * 45)
+        lines += StatusManager.__MetricsReport(summaries)
+        return "\n".join(lines)
+
+    @staticmethod
+    def __MetricsReport(summaries):
+        # Lines with the percentiles of the timings in the metrics log
+        if not summaries:
+            return []
+        # Per-run values, then per-solution values
+        rows = [(name, [s.get(name) for s in summaries])
+                for name in ("wait", "dedup", "submit", "first_result", "last_result", "total", "polls")]
+        rows += [(name, [v for s in summaries for v in s.get(name, [])])
+                 for name in ("submit_latency", "result_latency")]
+        lines = [f"Timings of the last {len(summaries)} runs (seconds; polls is a count)",
+                 f"{'':<15} | " + " | ".join(f"{f'p{p}':>8}" for p in PERCENTILES) + f" | {'max':>8}",
+                 "-" * 56]
+        for name, values in rows:
+            cells = [Percentile(values, p) for p in PERCENTILES + [100]]
+            lines.append(f"{name:<15} | " + " | ".join("       -" if c is None else f"{c:>8.3f}" for c in cells))
+        lines.append("-" * 56)
+        return lines
+
     
     # Function to record the submission of a new solution
     def New(self, status=''):
+        if status in list(StatusEnum):
+            status = str(status)
         try:
-            self.TrimCsvFile()
-            with open(self.status_file, mode="a", newline="") as file:
-                writer = csv.writer(file)
+            with self.__conn:
+                self.Trim()
                 current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                writer.writerow([current_time, self.recipient, status])
-                self.number = self.GetRowCount(self.status_file)  # Store the position in the file
+                cursor = self.__conn.execute(
+                    "INSERT INTO status (date, recipient, status) VALUES (?, ?, ?)",
+                    (current_time, self.recipient, status)
+                )
+                self.number = cursor.lastrowid  # Store the row of this run
+                # Take the ticket before the row becomes visible to the waiting runs
+                self.__Hold()
         except Exception as e:
             print(f"Unable to set the status. Error: {e}")
             exit()
@@ -119,17 +212,8 @@ class StatusManager():
         """returns current status
         
         """
-        # Read the CSV file
-        extracted_rows = []
-        with open(self.status_file, mode="r") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                extracted_rows.append(row)
-        
-        # Determine the current status
-        for i, row in enumerate(extracted_rows):
-            if i == self.number:
-                return row[2]
+        row = self.__conn.execute("SELECT status FROM status WHERE id = ?", (self.number,)).fetchone()
+        return row[0] if row else None
         
     
     # Function to modify the status of a sent solution
@@ -139,76 +223,140 @@ class StatusManager():
         if new_status in expected_statuses:
             new_status = str(new_status)
 
-        # Read the CSV file
-        extracted_rows = []
-        with open(self.status_file, mode="r") as file:
-            reader = csv.reader(file)
-            for row in reader:
-                extracted_rows.append(row)
-
-        # Find the specified row and update the status
-        for i, row in enumerate(extracted_rows):
-            if i == self.number:
-                row[0] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                row[2] = new_status
-
-        # Write the updated content to the CSV file
-        with open(self.status_file, mode="w", newline="") as file:
-            writer = csv.writer(file)
-            # Write data to the CSV file
-            for row in extracted_rows:
-                writer.writerow(row)
-
-    # 現在の件数を返す関数
-    def GetRowCount(self, file_path):
-        try:
-            with open(file_path, mode="r") as file:
-                reader = csv.reader(file)
-                row_count = sum(1 for row in reader)
-                return row_count
-        except FileNotFoundError:
-            return 0  # ファイルが存在しない場合は0を返す
-    
-    # Adjust the CSV file to a specified number of rows
-    def TrimCsvFile(self):
+        # Update only the row of this run
+        with self.__conn:
+            self.__conn.execute(
+                "UPDATE status SET date = ?, status = ? WHERE id = ?",
+                (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), new_status, self.number)
+            )
+        # Wake the next run of the same recipient
+        if new_status in TERMINAL_STATUSES:
+            self.__Release()
+
+    # Function to save the timings of this run to the metrics log
+    def SaveMetrics(self, summary):
+        if self.number is None:
+            return
+        with self.__conn:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO metrics (run, recipient, date, summary) VALUES (?, ?, ?, ?)",
+                (self.number, self.recipient, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), json.dumps(summary))
+            )
+            self.__conn.execute(
+                "DELETE FROM metrics WHERE run <= (SELECT MAX(run) FROM metrics) - ?",
+                (METRICS_LIMIT,)
+            )
+
+    # Keep at most max_row rows (rows of runs that are still in progress are kept)
+    def Trim(self):
         try:
-            with open(self.status_file, mode="r") as file:
-                rows = list(csv.reader(file))
-
-            if self.number >= self.max_row:
-                with open(self.status_file, mode="w", newline="") as file:
-                    writer = csv.writer(file)
-                    # Write the last (max_row-1) rows to the file
-                    for row in rows[-(self.max_row - 1):]:
-                        writer.writerow(row)
+            self.__conn.execute(
+                "DELETE FROM status WHERE id <= (SELECT MAX(id) FROM status) - ? "
+                f"AND status IN ({', '.join('?' for _ in TERMINAL_STATUSES)})",
+                (self.max_row - 1, *TERMINAL_STATUSES)
+            )
         except Exception as e:
-            print(f"Unable to trim the CSV file. Error: {e}")
+            print(f"Unable to trim the status. Error: {e}")
             exit()
 
     
     # Function to check if it is possible to send a new solution
     def CheckStatus(self):
         try:
-            # Open the CSV file and store it in a list
-            with open(self.status_file, mode="r") as file:
-                rows = list(csv.reader(file))
-
-            checks = [str(StatusEnum.EVALUATION_RECEIVED),
-                      str(StatusEnum.EVALUATION_RECEIVING_ERROR),
-                      str(StatusEnum.SOLUTION_SENDING_ERROR),
-                      str(StatusEnum.PREVIOUSLY_SOLUTION),
-                      str(StatusEnum.EXITED_WITH_CtrlC)]
-            rows = rows[:self.number]
-
-            for row in reversed(rows):
-                if self.recipient == row[1]:
-                    if row[2] in checks:
-                        return True
-                    else:
-                        return False
+            # Latest run of the same recipient before this one
+            row = self.__conn.execute(
+                "SELECT status FROM status WHERE recipient = ? AND id < ? ORDER BY id DESC LIMIT 1",
+                (self.recipient, self.number)
+            ).fetchone()
         except Exception as e:
-            print(f"Unable to check the CSV file. Error: {e}")
+            print(f"Unable to check the status. Error: {e}")
             self.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
             exit()
 
-        return True
+        if row is None:
+            return True
+        return row[0] in TERMINAL_STATUSES
+
+    # Function to wait for the turn of this run
+    def WaitTurn(self):
+        """Block until fewer than `slots` earlier runs of the same recipient are in progress.
+
+        Runs are served in the order of New (FIFO). The waiter sleeps on the ticket file
+        of the oldest earlier run in progress and is woken by the kernel as soon as that
+        run releases it, so no CPU is used while waiting. If that run exits without a
+        terminal status, its ticket is released by the OS and its row is marked as exited.
+        """
+        while True:
+            try:
+                # Earlier runs of the same recipient that have not finished yet
+                rows = self.__conn.execute(
+                    "SELECT id, status FROM status WHERE recipient = ? AND id < ? "
+                    f"AND status NOT IN ({', '.join('?' for _ in TERMINAL_STATUSES)}) ORDER BY id",
+                    (self.recipient, self.number, *TERMINAL_STATUSES)
+                ).fetchall()
+            except Exception as e:
+                print(f"Unable to check the status. Error: {e}")
+                self.SetStatus(StatusEnum.SOLUTION_SENDING_ERROR)
+                exit()
+            if len(rows) < self.slots:
+                return
+            previous, status = rows[0]
+            ticket = self.__TicketFile(previous)
+            # Sleep until the oldest run releases its ticket
+            with open(ticket, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # The ticket was released without a terminal status: the process of that run is gone
+            with self.__conn:
+                self.__conn.execute(
+                    "UPDATE status SET date = ?, status = ? WHERE id = ? AND status = ?",
+                    (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), str(StatusEnum.EXITED_UNEXPECTEDLY), previous, status)
+                )
+            self.__Remove(ticket)
+
+    # Function to record that earlier runs ended without a terminal status
+    def SetExited(self, numbers):
+        """Set the status of ended runs that are still in progress in the database to "Exited Unexpectedly".
+
+        Rows that already have a terminal status are kept.
+
+        Parameters
+        ----------
+        numbers (list):
+            Rows of the runs in the status database
+        """
+        with self.__conn:
+            self.__conn.executemany(
+                "UPDATE status SET date = ?, status = ? WHERE id = ? "
+                f"AND status NOT IN ({', '.join('?' for _ in TERMINAL_STATUSES)})",
+                [(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), str(StatusEnum.EXITED_UNEXPECTEDLY), number, *TERMINAL_STATUSES)
+                 for number in numbers]
+            )
+        for number in numbers:
+            self.__Remove(self.__TicketFile(number))
+
+    def __TicketFile(self, number):
+        # Path of the ticket file of the run stored in the given row
+        return os.path.join(self.__QUEUE_DIRECTORY, f"{number}.lock")
+
+    def __Hold(self):
+        # Lock the ticket of this run until it reaches a terminal status
+        os.makedirs(self.__QUEUE_DIRECTORY, exist_ok=True)
+        self.__Release()
+        self.__ticket = open(self.__TicketFile(self.number), 'a')
+        fcntl.flock(self.__ticket, fcntl.LOCK_EX)
+
+    def __Release(self):
+        # Unlock the ticket of this run (closing the file wakes the next run)
+        if self.__ticket is None:
+            return
+        ticket, self.__ticket = self.__ticket, None
+        self.__Remove(ticket.name)
+        ticket.close()
+
+    @staticmethod
+    def __Remove(path):
+        # Delete a ticket file that is no longer needed
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,158 @@
+#!/usr/local/bin/python
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify events that mean a file has been completely written in the directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+# Header of an inotify event (wd, mask, cookie, len), followed by len bytes of the name
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _LoadInotify():
+    # Return the C library if it provides inotify (Linux), otherwise None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class DirectoryWatcher:
+    """Waits for files to be written to a directory.
+
+    On Linux, inotify wakes the waiter as soon as a file is written, and a file counts
+    as complete once it has been closed after writing or renamed into the directory.
+    Elsewhere (or if inotify cannot be used) it simply waits until the timeout, and a
+    file counts as complete once its size is the same in two scans of the directory
+    (as do the files that were already in the directory when the watcher was created).
+
+    Parameters
+    ----------
+    directory: string
+        Directory to watch.
+    """
+    __libc = _LoadInotify()
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.__fd = None
+        if self.__libc is not None:
+            fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                wd = self.__libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+                if wd >= 0:
+                    self.__fd = fd
+                else:
+                    os.close(fd)
+        # Names of the files closed after writing or renamed into place since the watcher was created
+        self.__closed = set()
+        # Sizes of the files seen in the previous scan {name: size}
+        self.__sizes = {}
+        # Files written before the watcher was created have no events
+        self.__existing = set(self.__Sizes())
+
+    @property
+    def available(self):
+        """True if file events are delivered (otherwise only the timeout wakes the waiter)."""
+        return self.__fd is not None
+
+    def Wait(self, timeout):
+        """Block until a file is written to the directory or the timeout expires.
+        Return True if a file event woke the waiter.
+
+        Parameters
+        ----------
+        timeout (float):
+            Maximum number of seconds to wait
+        """
+        if self.__fd is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if ready:
+            self.__Drain()
+        return bool(ready)
+
+    async def WaitAsync(self, timeout):
+        """Same as Wait, without blocking the event loop.
+
+        Parameters
+        ----------
+        timeout (float):
+            Maximum number of seconds to wait
+        """
+        if self.__fd is None:
+            await asyncio.sleep(timeout)
+            return False
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        loop.add_reader(self.__fd, event.set)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(self.__fd)
+        self.__Drain()
+        return True
+
+    def Scan(self):
+        """Return the set of names of the files in the directory that are completely written (one scan per call).
+
+        A file whose size is checked for stability is returned from the second scan
+        in which it appears with the same size.
+        """
+        if self.__fd is not None:
+            self.__Drain()
+        sizes = self.__Sizes()
+        stable = self.__existing if self.__fd is not None else sizes
+        complete = {
+            name for name, size in sizes.items()
+            if name in self.__closed or (name in stable and self.__sizes.get(name) == size)
+        }
+        self.__sizes = sizes
+        return complete
+
+    def Close(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def __Sizes(self):
+        # Sizes of the files in the directory {name: size}
+        sizes = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    sizes[entry.name] = entry.stat().st_size
+                except FileNotFoundError:
+                    # Deleted (or renamed) during the scan
+                    continue
+        return sizes
+
+    def __Drain(self):
+        # Record the names of the files of the pending events
+        try:
+            while True:
+                data = os.read(self.__fd, 65536)
+                if not data:
+                    break
+                offset = 0
+                while offset + EVENT_HEADER.size <= len(data):
+                    _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                    offset += EVENT_HEADER.size
+                    name = data[offset:offset + length].split(b'\0', 1)[0]
+                    offset += length
+                    if name:
+                        self.__closed.add(os.fsdecode(name))
+        except BlockingIOError:
+            pass
+
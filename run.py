@@ -12,4 +12,73 @@ def Run(solutions = None, no_wait=False):
     """
     p = Main()
     result = p.Run(solutions, no_wait)
-    return result
\ No newline at end of file
+    return result
+
+def RunArray(population):
+    """Function to run module executable file with a 2-D NumPy array of solutions
+
+    Parameters
+    ----------
+    population (numpy.ndarray):
+        one solution per row
+
+    Returns
+    --------
+    objective, info (numpy.ndarray):
+        evaluation values and their 'info', aligned with the rows
+    """
+    p = Main()
+    return p.RunArray(population)
+
+def Resume():
+    """Function to receive the evaluation values of solutions submitted by runs that ended before receiving them
+
+    Returns
+    --------
+    results (dict):
+        {recipient: list of evaluation values} for each resumed recipient
+    """
+    p = Main()
+    return p.Resume()
+
+def RunIter(solutions = None):
+    """Function to run module executable file and receive each evaluation value as soon as it arrives
+
+    Parameters
+    ----------
+    solutions (list):
+        the solution you want to send
+    """
+    p = Main()
+    yield from p.RunIter(solutions)
+
+async def Submit(solutions = None):
+    """Function to send solutions from an asyncio event loop
+
+    Parameters
+    ----------
+    solutions (list):
+        the solution you want to send
+
+    Returns
+    --------
+    futures (list):
+        asyncio.Future for each solution
+    """
+    p = Main()
+    return await p.Submit(solutions)
+
+def Schedule(batches, workers=None, per_target=None):
+    """Function to send batches of solutions to several recipients at the same time
+
+    Parameters
+    ----------
+    batches (list):
+        List of (target, solutions) pairs, e.g. [("opt_1", solutions), ("qsub_opt2022_SOP2", solutions)]
+    workers (int):
+        Maximum number of batches running at the same time
+    per_target (int):
+        Maximum number of batches running at the same time for one target
+    """
+    p = Main()
+    return p.Schedule(batches, workers, per_target)